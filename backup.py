@@ -0,0 +1,218 @@
+#!/usr/bin/env python3.12
+"""ABot 数据备份工具
+
+备份：python backup.py dump [-o backup/20240101] [-c core_user "plugin_drift_bottle:*"]
+恢复：python backup.py restore backup/20240101 [-c core_user] [--drop]
+
+每个集合通过游标流式导出为一个压缩的 NDJSON 文件，恢复时分批无序写入，
+内存中最多只保留每个集合的一批文档；索引不会备份，恢复后启动机器人时由 beanie 重新创建
+"""
+
+import argparse
+import asyncio
+import fnmatch
+import json
+import os
+import pkgutil
+from collections.abc import Iterator
+from datetime import datetime
+from pathlib import Path
+from typing import IO
+from urllib.parse import quote, unquote
+
+import kayaku
+from bson import json_util
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo.errors import BulkWriteError
+from rich.progress import BarColumn, MofNCompleteColumn, Progress, TextColumn, TimeElapsedColumn
+
+kayaku.initialize({"{**}": "./config/{**}"})
+os.environ["PLAYWRIGHT_BROWSERS_PATH"] = Path(__file__).parent.joinpath("cache", "browser").as_posix()
+
+# ruff: noqa: E402
+from beanie import Document
+from creart import it
+from graia.saya import Saya
+
+from utils.archive import SEGMENT_SUFFIXES, default_suffix, open_reader, open_writer
+from utils.config import BasicConfig
+
+# 备份需要保留 int64、Decimal128 等类型，使用严格的 JSON 格式
+JSON_OPTIONS = json_util.CANONICAL_JSON_OPTIONS
+
+
+def discover_collections() -> list[str]:
+    """与 main.py 相同的方式加载所有插件，找到全部 Document 对应的集合"""
+    saya = it(Saya)
+    with saya.module_context():
+        for module_dir in Path("func").iterdir():
+            for module in pkgutil.iter_modules([str(module_dir)]):
+                if module.name.startswith("_"):
+                    continue
+                saya.require(f"{module_dir.parent}.{module_dir.name}.{module.name}")
+    names = set()
+    for model in Document.__subclasses__():
+        if model.__module__.startswith("beanie."):
+            continue
+        settings = getattr(model, "Settings", None)
+        names.add(getattr(settings, "name", None) or model.__name__)
+    return sorted(names)
+
+
+def select(names: list[str], patterns: list[str] | None) -> list[str]:
+    if not patterns:
+        return names
+    return [name for name in names if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)]
+
+
+def file_name(collection: str) -> str:
+    # 集合名中的 : 等字符不能直接用作文件名
+    return f"{quote(collection, safe='')}{default_suffix()}"
+
+
+def collection_name(path: Path) -> str:
+    name = path.name
+    for suffix in SEGMENT_SUFFIXES:
+        name = name.removesuffix(suffix)
+    return unquote(name)
+
+
+def _write_lines(writer: IO[bytes], docs: list[dict]) -> None:
+    writer.write(b"".join(json_util.dumps(doc, json_options=JSON_OPTIONS).encode() + b"\n" for doc in docs))
+
+
+def _read_batches(path: Path, batch_size: int) -> Iterator[list[dict]]:
+    with open_reader(path) as reader:
+        batch = []
+        for line in reader:
+            batch.append(json_util.loads(line, json_options=JSON_OPTIONS))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+async def dump_collection(db: AsyncIOMotorDatabase, name: str, out: Path, batch_size: int, progress: Progress) -> int:
+    collection = db[name]
+    task = progress.add_task(name, total=await collection.estimated_document_count())
+    path = out / file_name(name)
+    tmp = path.with_name(f"{path.name}.tmp")
+    writer = await asyncio.to_thread(open_writer, tmp)
+    count = 0
+    try:
+        batch: list[dict] = []
+        async for doc in collection.find().batch_size(batch_size):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                await asyncio.to_thread(_write_lines, writer, batch)
+                count += len(batch)
+                progress.update(task, completed=count)
+                batch = []
+        if batch:
+            await asyncio.to_thread(_write_lines, writer, batch)
+            count += len(batch)
+    finally:
+        await asyncio.to_thread(writer.close)
+    tmp.replace(path)
+    progress.update(task, completed=count, total=count)
+    return count
+
+
+async def restore_collection(
+    db: AsyncIOMotorDatabase, path: Path, batch_size: int, progress: Progress, *, drop: bool
+) -> int:
+    name = collection_name(path)
+    collection = db[name]
+    if drop:
+        await collection.drop()
+    task = progress.add_task(name, total=None)
+    batches = _read_batches(path, batch_size)
+    count = 0
+    while batch := await asyncio.to_thread(next, batches, None):
+        try:
+            await collection.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # 已存在的文档（重复键）直接跳过，使恢复可以重复执行
+            errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+            if errors:
+                raise
+        count += len(batch)
+        progress.update(task, completed=count)
+    progress.update(task, total=count)
+    return count
+
+
+def make_progress() -> Progress:
+    return Progress(TextColumn("{task.description}"), BarColumn(), MofNCompleteColumn(), TimeElapsedColumn())
+
+
+async def gather_limited(jobs: int, coros: list) -> list:
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def run(coro):  # noqa: ANN001, ANN202
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(coro) for coro in coros))
+
+
+async def dump(args: argparse.Namespace, db: AsyncIOMotorDatabase, names: list[str]) -> None:
+    out: Path = args.output
+    out.mkdir(parents=True, exist_ok=True)
+    with make_progress() as progress:
+        counts = await gather_limited(
+            args.jobs, [dump_collection(db, name, out, args.batch_size, progress) for name in names]
+        )
+    manifest = {
+        "database": db.name,
+        "time": datetime.now().astimezone().isoformat(),
+        "collections": dict(zip(names, counts, strict=True)),
+    }
+    (out / "manifest.json").write_text(json.dumps(manifest, ensure_ascii=False, indent=2), "utf-8")
+    print(f"已备份 {len(names)} 个集合，共 {sum(counts)} 个文档到 {out}")  # noqa: T201
+
+
+async def restore(args: argparse.Namespace, db: AsyncIOMotorDatabase) -> None:
+    source: Path = args.source
+    paths = [path for path in sorted(source.iterdir()) if path.name.endswith(SEGMENT_SUFFIXES)]
+    names = set(select([collection_name(path) for path in paths], args.collections))
+    paths = [path for path in paths if collection_name(path) in names]
+    with make_progress() as progress:
+        counts = await gather_limited(
+            args.jobs, [restore_collection(db, path, args.batch_size, progress, drop=args.drop) for path in paths]
+        )
+    print(f"已恢复 {len(paths)} 个集合，共 {sum(counts)} 个文档到 {db.name}")  # noqa: T201
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ABot 数据备份工具")
+    parser.add_argument("--uri", help="MongoDB 连接地址，默认读取配置文件")
+    parser.add_argument("--db", default="abot", help="数据库名")
+    parser.add_argument("-c", "--collections", nargs="*", help="只处理匹配的集合，支持通配符")
+    parser.add_argument("-j", "--jobs", type=int, default=4, help="同时处理的集合数")
+    parser.add_argument("-b", "--batch-size", type=int, default=1000, help="每批读写的文档数")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    dump_parser = subparsers.add_parser("dump", help="备份")
+    dump_parser.add_argument(
+        "-o", "--output", type=Path, default=Path("backup", datetime.now().strftime("%Y%m%d%H%M%S"))  # noqa: DTZ005
+    )
+    restore_parser = subparsers.add_parser("restore", help="恢复")
+    restore_parser.add_argument("source", type=Path)
+    restore_parser.add_argument("--drop", action="store_true", help="恢复前删除已有的集合")
+    args = parser.parse_args()
+
+    # 插件需要在 kayaku 启动前加载
+    names = select(discover_collections(), args.collections) if args.command == "dump" else []
+    kayaku.bootstrap()
+    uri = args.uri or kayaku.create(BasicConfig).database_uri
+
+    async def run() -> None:
+        db = AsyncIOMotorClient(uri)[args.db]
+        await (dump(args, db, names) if args.command == "dump" else restore(args, db))
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
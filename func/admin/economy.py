@@ -0,0 +1,89 @@
+from typing import Annotated
+
+import kayaku
+from avilla.core import Context, MessageChain, MessageReceived
+from avilla.twilight.twilight import ResultValue, Twilight, UnionMatch, WildcardMatch
+from graia.saya import Channel
+from graia.scheduler.saya.schema import SchedulerSchema
+from graia.scheduler.timers import crontabify
+from graiax.shortcut import dispatch, listen
+from loguru import logger
+
+from models.saya import FuncType
+from utils.config import BasicConfig
+from utils.db import AUser, EconomyRollup, EconomyStats, coin_log_buffer
+from utils.message.picture import SelfPicture
+from utils.message.preprocessor import MentionMe
+from utils.saya import build_metadata
+from utils.text2image import md2img
+
+channel = Channel.current()
+channel.meta = build_metadata(
+    func_type=FuncType.admin,
+    name="经济统计",
+    version="1.0",
+    description="查看游戏币的发行、回收和余额分布，统计数据每小时增量更新",
+    cmd_prefix="economy",
+    usage=["发送指令：economy <天数>"],
+    options=[{"name": "天数", "help": "显示最近几天的统计，默认为 7，可选"}],
+    can_be_disabled=False,
+    hidden=True,
+)
+config = kayaku.create(BasicConfig)
+rollup = EconomyRollup()
+
+
+@channel.use(SchedulerSchema(crontabify("10 * * * *")))
+async def scheduled_rollup():  # noqa: ANN201
+    # 先写入缓冲中的流水，之后再按水位汇总
+    await coin_log_buffer.flush()
+    count = await rollup.rollup()
+    stats = await rollup.snapshot()
+    logger.info(f"[Task.economy] 已汇总 {count} 条流水，当前游戏币总量 {stats.supply}")
+
+
+def render(days: list[EconomyStats]) -> str:
+    latest = next((day for day in days if day.snapshot_at), None)
+    text = "# 经济统计\n\n"
+    if latest:
+        text += (
+            f"- 游戏币总量：{latest.supply}\n"
+            f"- 用户数：{latest.users}\n"
+            f"- 快照时间：{latest.snapshot_at:%Y-%m-%d %H:%M}\n\n"
+            "### 余额分布\n"
+            "| 余额 | 人数 | 游戏币 |\n"
+            "| :--- | --: | --: |\n"
+        )
+        for bucket in latest.distribution:
+            if bucket.min is None:
+                label = "其他"
+            elif bucket.max is None:
+                label = f"≥ {bucket.min}"
+            else:
+                label = f"{bucket.min} ~ {bucket.max - 1}"
+            text += f"| {label} | {bucket.users} | {bucket.coins} |\n"
+
+    text += "\n### 每日流水\n| 日期 | 发行 | 回收 | 净增 | 笔数 |\n| :--- | --: | --: | --: | --: |\n"
+    for day in days:
+        text += f"| {day.id} | {day.minted} | {day.burned} | {day.net:+} | {day.records} |\n"
+
+    if days and days[0].sources:
+        text += f"\n### {days[0].id} 各来源\n| 来源 | 发行 | 回收 | 笔数 |\n| :--- | --: | --: | --: |\n"
+        for source, stats in sorted(days[0].sources.items(), key=lambda x: -(x[1].minted + x[1].burned)):
+            text += f"| {source} | {stats.minted} | {stats.burned} | {stats.records} |\n"
+    return text
+
+
+@listen(MessageReceived)
+@dispatch(
+    Twilight([UnionMatch("economy", "经济统计"), "arg_days" @ WildcardMatch(optional=True)], preprocessor=MentionMe())
+)
+async def main(ctx: Context, auser: AUser, arg_days: Annotated[MessageChain, ResultValue()]):  # noqa: ANN201
+    if not config.owner or auser.aid != config.owner:
+        return None
+    days = str(arg_days).strip()
+    days = int(days) if days.isdigit() else 7
+    stats = await rollup.recent(min(max(days, 1), 60))
+    if not stats:
+        return await ctx.scene.send_message("暂无统计数据，统计任务每小时执行一次")
+    return await ctx.scene.send_message(await SelfPicture().from_data(await md2img(render(stats), width=700)))
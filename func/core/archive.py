@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import kayaku
+from graia.saya import Channel
+from graia.scheduler.saya.schema import SchedulerSchema
+from graia.scheduler.timers import crontabify
+from launart import Launart
+from loguru import logger
+
+from models.saya import FuncType
+from services import S3FileService
+from utils.archive import LogArchiver
+from utils.config import BasicConfig
+from utils.db import ChatLog, ChatText, CoinLog
+from utils.saya import build_metadata
+
+channel = Channel.current()
+channel.meta = build_metadata(
+    func_type=FuncType.core,
+    name="日志归档",
+    version="1.0",
+    description="每日凌晨 4 点 30 分将旧的聊天和游戏币日志归档到压缩文件中",
+    can_be_disabled=False,
+    hidden=True,
+)
+
+
+@channel.use(SchedulerSchema(crontabify("30 4 * * *")))
+async def main() -> None:
+    config = kayaku.create(BasicConfig).archive
+    if not config.enabled:
+        return
+    s3file = Launart.current().get_component(S3FileService).s3file if config.upload_s3 else None
+    for document in (ChatLog, CoinLog):
+        # 归档的聊天记录内联其引用的长文本，之后可以脱离 ChatText 读取
+        prepare = ChatText.inline if document is ChatLog else None
+        archiver = LogArchiver(document, Path(config.path), s3file=s3file, prepare=prepare)
+        try:
+            total = await archiver.archive(config.older_than_days)
+        except Exception:
+            logger.exception(f"[Task.archive] {archiver.collection_name} 归档失败")
+            continue
+        logger.info(f"[Task.archive] {archiver.collection_name} 共归档 {total} 条日志")
+        if document is ChatLog:
+            # 只被已归档的聊天记录引用的文本不再需要，多保留一天以覆盖写入时 last_seen 的延迟
+            before = datetime.now() - timedelta(days=config.older_than_days + 1)  # noqa: DTZ005
+            logger.info(f"[Task.archive] 已清理 {await ChatText.prune(before)} 条不再引用的聊天文本")
@@ -1,79 +1,183 @@
-import math
+import time
+from datetime import datetime
 
-from avilla.core import Context, Selector, BaseAccount, Avilla
-from beanie.odm.enums import SortDirection
-from beanie.odm.operators.find.comparison import GT, GTE, Eq
-from beanie.odm.operators.update.general import Set
 from graia.saya import Channel
 from graia.scheduler.saya.schema import SchedulerSchema
 from graia.scheduler.timers import crontabify
 from loguru import logger
 
-import kayaku
 from models.saya import FuncType
-from utils.builder import AUserBuilder
-from utils.db import AUser
+from utils.builder import user_cache
+from utils.datetime import current_day
+from utils.db import AUser, CoinLog, user_counter
 from utils.saya import build_metadata
-from utils.config import BasicConfig
 
 channel = Channel.current()
 channel.meta = build_metadata(
     func_type=FuncType.core,
     name="日常维护",
-    version="1.0",
+    version="1.2",
     description="每日凌晨 4 点定时执行的任务",
     can_be_disabled=False,
     hidden=True,
 )
 
+# leadder_rent 算法为超过 1000 的部分，每多 100 个游戏币加收百分之一的税
+RENT_RATE = {"$divide": [{"$ceil": {"$divide": [{"$subtract": ["$coin", 1000]}, 100]}}, 100]}
+RENT = {"$ceil": {"$multiply": ["$coin", RENT_RATE]}}
+# 每日税额的暂存集合
+RENT_STAGING = "core_daily_rent"
+
+
+class PhaseTimer:
+    def __init__(self) -> None:
+        self.phases: dict[str, float] = {}
+        self._last = time.perf_counter()
+
+    def lap(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+    def __str__(self) -> str:
+        return "，".join(f"{phase} {cost:.3f}s" for phase, cost in self.phases.items())
+
 
 @channel.use(SchedulerSchema(crontabify("0 4 * * *")))
 async def main():  # noqa: ANN201
-    all_num, sign_num, chat_num = await activity_count()
-    # cache, delete_cache = delete_old_cache()
-    total_rent = await ladder_rent_collection()
+    timer = PhaseTimer()
+    # 先写入缓冲中的发言计数，保证统计到的活跃状态是最新的
+    await user_counter.flush()
+    timer.lap("计数写入")
+    # 用户的当日状态会在首次访问时按日序号懒重置，这里统计的是刚结束的一天
+    yesterday = current_day() - 1
+    all_num, sign_num, chat_num = await activity_count(yesterday)
+    timer.lap("统计")
+    await ladder_rent_collection()
+    timer.lap("收税")
+    total_rent, rent_num = await rent_count()
+    await write_rent_log()
+    timer.lap("税收流水")
 
     task_text = (
-        f"签到重置成功\n"
+        f"每日统计完成\n"
         f"签到率 {sign_num!s} / {all_num!s} "
         f"{f'{sign_num / all_num:.2%}' if all_num > 0 else 'NaN'}\n"
         f"活跃率 {chat_num!s} / {all_num!s} "
         f"{f'{chat_num / all_num:.2%}' if all_num > 0 else 'NaN'}\n"
         f"活跃签到率 {sign_num!s} / {chat_num!s} "
         f"{f'{sign_num / chat_num:.2%}' if chat_num > 0 else 'NaN'}\n"
-        f"今日收取了 {total_rent} 游戏币\n"
-        # f"缓存清理 {delete_cache}/{cache} 个"
+        f"今日向 {rent_num} 人收取了 {total_rent} 游戏币\n"
     )
     [logger.info(f"[Task.daily] {line}") for line in task_text.split("\n") if line]
 
-    await reset_status()
+    # AUser 的修改都是针对字段的更新，缓存中的实例不会把扣税前的余额写回数据库，
+    # 这里只是让缓存重新加载扣税后的余额（支持 change stream 时已由缓存失效处理）
+    user_cache.clear()
+    logger.info(f"[Task.daily] 各阶段耗时：{timer}")
+
 
+async def ladder_rent_collection() -> None:
+    """先将本次税额计算到暂存集合中，再按暂存的税额在数据库中直接扣税
 
-async def activity_count() -> tuple[int, int, int]:
-    all_num = await AUser.count()
-    sign_num = await AUser.find_many(Eq(AUser.is_sign, True)).count()
-    chat_num = await AUser.find_many(Eq(AUser.is_chat, True)).count()
+    税额超过余额的用户不扣除（与 reduce_coin 余额不足时的行为一致）；
+    暂存集合由 $out 整体替换，上次中断的任务留下的数据会被清除，用户文档上不会留下临时字段
+    """
+    collection = AUser.get_motor_collection()
+    await collection.aggregate(
+        [
+            {"$match": {"coin": {"$gte": 1000}, "$expr": {"$lte": [RENT, "$coin"]}}},
+            {"$project": {"cid": True, "rent": RENT, "rate": RENT_RATE}},
+            {"$out": RENT_STAGING},
+        ]
+    ).to_list(None)
+    await collection.database[RENT_STAGING].aggregate(
+        [
+            {"$project": {"rent": True}},
+            {
+                "$merge": {
+                    "into": AUser.get_settings().name,
+                    "on": "_id",
+                    # 计算税额之后余额可能已经减少，扣税时不会扣成负数
+                    "whenMatched": [{"$set": {"coin": {"$max": [{"$subtract": ["$coin", "$$new.rent"]}, 0]}}}],
+                    "whenNotMatched": "discard",
+                }
+            },
+        ]
+    ).to_list(None)
 
-    return all_num, sign_num, chat_num
 
+async def activity_count(yesterday: int) -> tuple[int, int, int]:
+    """统计总人数和昨日签到、发言人数
 
-async def ladder_rent_collection() -> int:
-    user_list = AUser.find_many(GTE(AUser.coin, 1000)).sort(("coin", SortDirection.DESCENDING))
-    total_rent = 0
-    async for user in user_list:
-        auser = await AUserBuilder.init(user)
-        # leadder_rent 算法为超过 1000 的部分，每多 100 个游戏币加收百分之一的税
-        leadder_rent = math.ceil((user.coin - 1000) / 100) / 100
-        reduce_coin = math.ceil(user.coin * leadder_rent)
-        total_rent += reduce_coin
-        await auser.reduce_coin(reduce_coin, source="梯度持有税", detail=f"税率：{leadder_rent}")
-        logger.info(f"[Task.daily] {user.cid} 被收取了 {reduce_coin} 游戏币")
-    return total_rent
+    昨日的状态可能已经被今天的首次访问重置，重置前的状态记录在 last_sign_epoch/last_chat_epoch 中
+    """
+    result = (
+        await AUser.get_motor_collection()
+        .aggregate(
+            [
+                {
+                    "$facet": {
+                        "all": [{"$count": "num"}],
+                        "sign": [
+                            {
+                                "$match": {
+                                    "$or": [{"is_sign": True, "day_epoch": yesterday}, {"last_sign_epoch": yesterday}]
+                                }
+                            },
+                            {"$count": "num"},
+                        ],
+                        "chat": [
+                            {
+                                "$match": {
+                                    "$or": [{"is_chat": True, "day_epoch": yesterday}, {"last_chat_epoch": yesterday}]
+                                }
+                            },
+                            {"$count": "num"},
+                        ],
+                    }
+                }
+            ]
+        )
+        .to_list(None)
+    )
+    facet = result[0]
+
+    def first(name: str) -> int:
+        return int(facet[name][0]["num"]) if facet[name] else 0
+
+    return first("all"), first("sign"), first("chat")
+
+
+async def rent_count() -> tuple[int, int]:
+    """由暂存集合统计本次的税收总额和收税人数"""
+    rent = await (
+        AUser.get_motor_collection()
+        .database[RENT_STAGING]
+        .aggregate([{"$group": {"_id": None, "total": {"$sum": "$rent"}, "num": {"$sum": 1}}}])
+        .to_list(None)
+    )
+    return (int(rent[0]["total"]), int(rent[0]["num"])) if rent else (0, 0)
 
 
-async def reset_status() -> None:
-    await AUser.find_many(Eq(AUser.is_sign, False)).update_many(Set({AUser.continue_sign: 0}))
-    await AUser.find_many(Eq(AUser.is_sign, True)).update_many(Set({AUser.is_sign: False}))
-    await AUser.find_many(Eq(AUser.is_chat, True)).update_many(Set({AUser.is_chat: False}))
-    await AUser.find_many(GT(AUser.today_transferred, 0)).update_many(Set({AUser.today_transferred: 0}))
-    logger.info("[Task.daily] 用户日常状态重置成功")
+async def write_rent_log() -> None:
+    """由暂存集合批量生成税收流水，然后删除暂存集合"""
+    staging = AUser.get_motor_collection().database[RENT_STAGING]
+    await staging.aggregate(
+        [
+            {
+                "$project": {
+                    "_id": 0,
+                    "qid": "$cid",
+                    "group_id": "None",
+                    "coin": {"$subtract": [0, "$rent"]},
+                    "source": "梯度持有税",
+                    "detail": {"$concat": ["税率：", {"$toString": "$rate"}]},
+                    # 与 CoinLog.time 的默认值保持一致
+                    "time": datetime.now(),  # noqa: DTZ005
+                }
+            },
+            {"$merge": {"into": CoinLog.get_settings().name, "whenMatched": "fail"}},
+        ]
+    ).to_list(None)
+    await staging.drop()
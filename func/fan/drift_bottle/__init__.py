@@ -236,20 +236,21 @@ async def throw_bottle_handler(  # noqa: ANN201
     ).wait(30, False):
         return await ctx.scene.send_message("投掷漂流瓶已取消")
 
-    if await auser.reduce_coin(bottle_price, group_id=group_data.group_id, source="漂流瓶", detail=price_msg):
-        bottle = await throw_bottle(
-            auser.aid,
-            group_data.group_id,
-            text,
-            remaining,
-            [x.resource.filename for x in images],  # type: ignore
-            ReviewStatus.PENDING if review_list else ReviewStatus.AI_APPROVED,
-            anonymous=anonymous,
-        )
-        return await ctx.scene.send_message(
-            f"成功购买并丢出漂流瓶！\n瓶子编号：{bottle}" + ("\n漂流瓶正在等待人工审核" if review_list else "")
-        )
-    return await ctx.scene.send_message(f"游戏币不足，无法丢出漂流瓶。{price_msg}")
+    if await auser.reduce_coin(bottle_price, group_id=group_data.group_id, source="漂流瓶", detail=price_msg) is None:
+        return await ctx.scene.send_message(f"游戏币不足，无法丢出漂流瓶。{price_msg}")
+
+    bottle = await throw_bottle(
+        auser.aid,
+        group_data.group_id,
+        text,
+        remaining,
+        [x.resource.filename for x in images],  # type: ignore
+        ReviewStatus.PENDING if review_list else ReviewStatus.AI_APPROVED,
+        anonymous=anonymous,
+    )
+    return await ctx.scene.send_message(
+        f"成功购买并丢出漂流瓶！\n瓶子编号：{bottle}" + ("\n漂流瓶正在等待人工审核" if review_list else "")
+    )
 
 
 @listen(MessageReceived)
@@ -265,7 +266,7 @@ async def fish_bottle_handler(ctx: Context, group_data: GroupData, auser: AUser,
     if not bottle:
         return await ctx.scene.send_message("没有漂流瓶可以捡哦！")
     logger.debug(f"[Func.drift_bottle] 捞到的漂流瓶：{bottle.bottle_id}")
-    if not await auser.reduce_coin(3, group_id=group_data.group_id, source="漂流瓶", detail="捞瓶子"):
+    if await auser.reduce_coin(3, group_id=group_data.group_id, source="漂流瓶", detail="捞瓶子") is None:
         return await ctx.scene.send_message("你的游戏币不足，无法捞漂流瓶！")
 
     await bottle.pickup()
@@ -11,6 +11,7 @@ from pydantic import Field
 from pymongo import IndexModel
 
 from utils.datetime import CHINA_TZ
+from utils.db import SequenceAllocator
 
 
 class ReviewStatus(Enum):
@@ -92,6 +93,14 @@ class BottleDiscuss(Document):
         indexes = [IndexModel("bottle_id"), IndexModel("aid")]
 
 
+async def _max_bottle_id() -> int:
+    last_bottle = await DriftingBottle.find_one(sort=[("bottle_id", SortDirection.DESCENDING)])
+    return int(last_bottle.bottle_id) if last_bottle else 0
+
+
+bottle_sequence = SequenceAllocator("bottle_id", seed=_max_bottle_id)
+
+
 async def throw_bottle(
     aid: int,
     group_id: str,
@@ -106,8 +115,7 @@ async def throw_bottle(
         msg = "漂流瓶内容不能为空!"
         raise ValueError(msg)
 
-    last_id = await DriftingBottle.find_one(sort=[("_id", SortDirection.DESCENDING)])
-    bottle_id = int(last_id.bottle_id) + 1 if last_id else 1
+    bottle_id = await bottle_sequence.next()
 
     await DriftingBottle.insert(
         DriftingBottle(
@@ -121,15 +129,13 @@ async def throw_bottle(
             review_status=review_status,
         )
     )
-    bottle = await DriftingBottle.find_one(Eq(BottleScore.bottle_id, bottle_id))
-    if not bottle:
-        msg = "漂流瓶创建失败"
-        raise ValueError(msg)
-    return bottle.bottle_id
+    return bottle_id
 
 
 async def get_bottle_score(bottle_id: int) -> float | None:
-    scores = BottleScore.find(Eq(BottleScore.bottle_id, bottle_id)).sort(("score", SortDirection.ASCENDING))
+    scores = BottleScore.find(Eq(BottleScore.bottle_id, bottle_id), lazy_parse=True).sort(
+        ("score", SortDirection.ASCENDING)
+    )
     score_count = await scores.count()
     if score_count < 3:
         return None
@@ -169,9 +175,10 @@ def get_all_bottles() -> FindMany[DriftingBottle]:
 
 
 def get_bottles_by_aid(aid: int) -> FindMany[DriftingBottle]:
-    return DriftingBottle.find_many(Eq(DriftingBottle.aid, aid), Eq(DriftingBottle.isdelete, False)).sort(
-        ("_id", SortDirection.DESCENDING)
-    )
+    # 列表只展示部分字段，按需解析以减少校验开销
+    return DriftingBottle.find_many(
+        Eq(DriftingBottle.aid, aid), Eq(DriftingBottle.isdelete, False), lazy_parse=True
+    ).sort(("_id", SortDirection.DESCENDING))
 
 
 def get_self_discuss(aid: int, bottle_id: int) -> FindMany[BottleDiscuss]:
@@ -4,8 +4,8 @@ from markdown_it.token import Token
 
 from func.fan.drift_bottle.crud import DriftingBottle
 from services import S3File
-from utils.builder import AUserBuilder
 from utils.config import BasicConfig
+from utils.db import AUser, AUserCore
 from utils.text2image import md_converter
 
 basic_config = kayaku.create(BasicConfig)
@@ -14,7 +14,7 @@ basic_config = kayaku.create(BasicConfig)
 async def bottle_md_builder(s3file: S3File, bottle: DriftingBottle) -> str:
     bottle_md = f"# 你成功捞到一个漂流瓶！\n\n### 漂流瓶编号：{bottle.bottle_id}"
     if not bottle.anonymous:
-        bottle_user = await AUserBuilder.get_user(bottle.aid, "aid")
+        bottle_user = await AUser.find_one(AUser.aid == bottle.aid).project(AUserCore)
         if not bottle_user:
             msg = f"漂流瓶 {bottle.bottle_id} 的用户 {bottle.aid} 不存在"
             raise RuntimeError(msg)
@@ -3,6 +3,8 @@ from beanie.odm.operators.find.comparison import Eq
 from beanie.odm.operators.update.general import Set
 from pymongo import IndexModel
 
+from utils.cache import TTLCache, register_invalidation
+
 
 class ServerBind(Document):
     group_id: str
@@ -13,8 +15,16 @@ class ServerBind(Document):
         indexes = [IndexModel("group")]
 
 
+# 群号 -> 绑定的服务器地址，未绑定的群缓存为空字符串
+bind_cache: TTLCache[str, str] = TTLCache(maxsize=1024, ttl=3600)
+register_invalidation(ServerBind, lambda _: bind_cache.clear())
+
+
 async def get_bind(group: str | int) -> str | None:
+    if (address := bind_cache.get(str(group))) is not None:
+        return address or None
     bind = await ServerBind.find_one(Eq(ServerBind.group_id, str(group)))
+    bind_cache.set(str(group), bind.address if bind else "")
     if bind:
         return bind.address
     return None
@@ -26,7 +36,9 @@ async def set_bind(group: str | int, address: str) -> None:
         Set({ServerBind.address: address}),
         on_insert=ServerBind(group_id=str(group), address=address),
     ) # type: ignore
+    bind_cache.pop(str(group))
 
 
 async def delete_bind(group: str | int) -> None:
     await ServerBind.find_one(Eq(ServerBind.group_id, str(group))).delete()
+    bind_cache.pop(str(group))
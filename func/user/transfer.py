@@ -14,7 +14,7 @@ from graiax.shortcut import FunctionWaiter, dispatch, listen
 
 from models.saya import FuncType
 from utils.builder import AUserBuilder
-from utils.db import AUser, GroupData
+from utils.db import DAILY_TRANSFER_LIMIT, AUser, GroupData, TransferStatus, transfer_coin
 from utils.message.preprocessor import MentionMe
 from utils.saya import build_metadata
 
@@ -22,7 +22,7 @@ channel = Channel.current()
 channel.meta = build_metadata(
     func_type=FuncType.user,
     name="转账",
-    version="1.2",
+    version="1.3",
     description="转移游戏币给其他人",
     cmd_prefix="transfer",
     usage=["发送指令：transfer <At / aid> <数量> [-a, --all]"],
@@ -107,9 +107,9 @@ async def main(  # noqa: ANN201
     if num > auser.coin:
         return await ctx.scene.send_message("你没有足够的游戏币")
 
-    if auser.today_transferred + num > 200:
+    if auser.today_transferred + num > DAILY_TRANSFER_LIMIT:
         return await ctx.scene.send_message(
-            f"需要转账的数量已超过今日限额，今日还可以转账 {200 - auser.today_transferred} 个游戏币"
+            f"需要转账的数量已超过今日限额，今日还可以转账 {DAILY_TRANSFER_LIMIT - auser.today_transferred} 个游戏币"
         )
 
     await ctx.scene.send_message(f"正在转账 {num} 个游戏币给 AID：{recipient_user.aid}，请发送 `@ABot y` 确认转账")
@@ -132,11 +132,17 @@ async def main(  # noqa: ANN201
     ).wait(30, False):
         return await ctx.scene.send_message("转账已取消")
 
-    await auser.reduce_coin(
-        num, group_id=group_data.group_id, source="转账", detail=f"转账给 AID：{recipient_user.aid}"
-    )
-    await recipient_user.add_coin(num, group_id=group_data.group_id, source="转账", detail=f"来自 AID：{auser.aid}")
-    auser.today_transferred += num
-    await auser.save()  # type: ignore
+    # 等待确认期间余额或限额可能已经变化，由转账操作原子地重新检查
+    result = await transfer_coin(auser, recipient_user, num, group_data.group_id)
+    if result.status == TransferStatus.INSUFFICIENT_COIN:
+        return await ctx.scene.send_message("你没有足够的游戏币")
+    if result.status == TransferStatus.SENDER_MISSING:
+        return await ctx.scene.send_message("你的用户数据不存在，转账已取消")
+    if result.status == TransferStatus.RECIPIENT_MISSING:
+        return await ctx.scene.send_message("对方用户不存在，转账已取消")
+    if result.status == TransferStatus.EXCEED_LIMIT:
+        return await ctx.scene.send_message(
+            f"需要转账的数量已超过今日限额，今日还可以转账 {DAILY_TRANSFER_LIMIT - result.today_transferred} 个游戏币"
+        )
 
     return await ctx.scene.send_message(f"已经成功给 AID：{recipient_user.aid} 转账 {num} 个游戏币")
@@ -29,10 +29,23 @@ kayaku.initialize({"{**}": "./config/{**}"})
 os.environ["PLAYWRIGHT_BROWSERS_PATH"] = Path(__file__).parent.joinpath("cache", "browser").as_posix()
 
 # ruff: noqa: E402
-from services import AiohttpClientService, MongoDBService, S3FileService
+from services import (
+    AiohttpClientService,
+    CacheInvalidationService,
+    ChatLogWriter,
+    FooterPrefetchService,
+    MigrationService,
+    MongoDBService,
+    PagePoolService,
+    QueryProfilerService,
+    S3FileService,
+    WriteBehindService,
+)
 from services.plugin_init import PluginInitService
 from utils.config import BasicConfig
+from utils.db import ad_display_buffer, ad_view_counter, coin_log_buffer, user_counter
 from utils.saya.dispachers import ABotDispatcher
+from utils.text2image import page_pool, render_cache
 
 loop = it(AbstractEventLoop)
 bcc = it(Broadcast)
@@ -56,14 +69,22 @@ kayaku.save_all()
 # Avilla 默认添加 MemcacheService
 launart.add_component(SchedulerService(it(GraiaScheduler)))
 launart.add_component(AiohttpClientService())
-launart.add_component(MongoDBService(config.database_uri))
+if config.query_profiler:
+    launart.add_component(QueryProfilerService(Path("data/query_profile.md")))
+launart.add_component(MongoDBService(config.database_uri, config.log_retention, config.database_pool))
+launart.add_component(WriteBehindService(user_counter, coin_log_buffer, ad_view_counter, ad_display_buffer))
+launart.add_component(ChatLogWriter())
+launart.add_component(CacheInvalidationService())
+launart.add_component(MigrationService())
 launart.add_component(
     S3FileService(
         config.s3file.endpoint, config.s3file.access_key, config.s3file.secret_key, secure=config.s3file.secure
     )
 )
+launart.add_component(FooterPrefetchService(config.render.footer_refresh_interval))
 launart.add_component(PluginInitService())
 launart.add_component(PlaywrightService())
+launart.add_component(PagePoolService(page_pool, render_cache))
 launart.add_component(AlconnaGraiaService(AlconnaAvillaAdapter, enable_cache=False, global_remove_tome=True))
 
 avilla = Avilla(broadcast=bcc, launch_manager=launart, record_send=config.log_chat)
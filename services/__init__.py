@@ -1,3 +1,10 @@
 from .aiohttp import AiohttpClientService
+from .cache_invalidation import CacheInvalidationService
+from .chat_log import ChatLogWriter
 from .database import MongoDBService
+from .footer import FooterPrefetchService
+from .migration import MigrationService
+from .page_pool import PagePoolService
+from .profiler import QueryProfilerService
 from .s3file import S3File, S3FileService
+from .write_behind import WriteBehindService
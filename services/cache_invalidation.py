@@ -0,0 +1,122 @@
+import asyncio
+import re
+from typing import Any
+
+from beanie import Document
+from launart import Launart, Service
+from loguru import logger
+from pymongo.errors import OperationFailure, PyMongoError
+
+from utils.cache import ORIGIN_FIELD, PROCESS_ORIGIN, invalidate, watched_documents
+
+# $changeStream 只能在副本集或分片集群上使用
+NOT_REPLICA_SET = 40573
+# 断线太久，resume token 对应的 oplog 已被覆盖
+CHANGE_STREAM_HISTORY_LOST = 286
+
+
+def _pipeline(ignore_fields: set[str]) -> list[dict[str, Any]]:
+    """只接收会影响缓存的变更，在服务端过滤掉本进程自己的写入和只修改了 ignore_fields 中字段的 update"""
+    pipeline: list[dict[str, Any]] = [
+        # 本进程的写入已经同步到了缓存的文档实例中
+        {"$match": {f"updateDescription.updatedFields.{ORIGIN_FIELD}": {"$not": re.compile(f"^{PROCESS_ORIGIN}:")}}}
+    ]
+    if not ignore_fields:
+        return pipeline
+    changed = {
+        "$filter": {
+            "input": {"$objectToArray": {"$ifNull": ["$updateDescription.updatedFields", {}]}},
+            "cond": {"$not": {"$in": ["$$this.k", sorted(ignore_fields)]}},
+        }
+    }
+    removed = {"$ifNull": ["$updateDescription.removedFields", []]}
+    pipeline.append(
+        {
+            "$match": {
+                "$or": [
+                    {"operationType": {"$ne": "update"}},
+                    {"$expr": {"$or": [{"$gt": [{"$size": changed}, 0]}, {"$gt": [{"$size": removed}, 0]}]}},
+                ]
+            }
+        }
+    )
+    return pipeline
+
+
+class CacheInvalidationService(Service):
+    """监听已注册缓存的集合的 change stream，在其他进程修改数据库时使进程内缓存失效
+
+    单机部署的 MongoDB 不支持 change stream，此时退化为每隔 poll_interval 秒清空一次缓存
+    """
+
+    id = "abot/cache_invalidation"
+
+    def __init__(self, poll_interval: float = 300, retry_interval: float = 5) -> None:
+        super().__init__()
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+
+    @property
+    def required(self) -> set[str]:
+        return {"abot/mongodb"}
+
+    @property
+    def stages(self) -> set[str]:
+        return {"blocking"}
+
+    @staticmethod
+    def _dispatch(document: type[Document], change: dict[str, Any]) -> None:
+        if change["operationType"] in {"insert", "update", "replace", "delete"}:
+            invalidate(document, change["documentKey"]["_id"])
+        else:
+            # drop、rename、invalidate 等集合级别的变更
+            invalidate(document, None)
+
+    async def _poll(self, document: type[Document]) -> None:
+        name = document.get_settings().name
+        logger.warning(
+            f"[Core.cache] 当前 MongoDB 不支持 change stream，{name} 的缓存将每 {self.poll_interval} 秒失效一次"
+        )
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            invalidate(document, None)
+
+    async def _watch(self, document: type[Document], ignore_fields: set[str]) -> None:
+        collection = document.get_motor_collection()
+        name = document.get_settings().name
+        pipeline = _pipeline(ignore_fields)
+        token = None
+        while True:
+            try:
+                async with collection.watch(pipeline, resume_after=token) as stream:
+                    logger.debug(f"[Core.cache] 开始监听 {name} 的变更")
+                    try:
+                        async for change in stream:
+                            self._dispatch(document, change)
+                    finally:
+                        token = stream.resume_token
+                # 集合被删除或重命名后 change stream 会失效，不能再从失效事件继续
+                token = None
+            except OperationFailure as e:
+                if e.code == NOT_REPLICA_SET:
+                    await self._poll(document)
+                    return
+                if e.code == CHANGE_STREAM_HISTORY_LOST:
+                    token = None
+                    invalidate(document, None)
+                logger.warning(f"[Core.cache] 监听 {name} 的变更失败：{e}")
+            except PyMongoError as e:
+                logger.warning(f"[Core.cache] 监听 {name} 的变更中断，将在 {self.retry_interval} 秒后继续：{e}")
+            await asyncio.sleep(self.retry_interval)
+
+    async def launch(self, launart: Launart) -> None:
+        async with self.stage("blocking"):
+            tasks = [
+                asyncio.create_task(self._watch(document, ignore_fields))
+                for document, ignore_fields in watched_documents().items()
+            ]
+            logger.info(f"[Core.cache] 已为 {len(tasks)} 个集合启用缓存失效")
+            await launart.status.wait_for_sigexit()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
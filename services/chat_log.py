@@ -0,0 +1,192 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+from launart import Launart, Service
+from loguru import logger
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from utils.cache import TTLCache
+from utils.db import ChatLog, ChatText
+
+if TYPE_CHECKING:
+    from beanie import PydanticObjectId
+
+
+class ChatLogWriter(Service):
+    """聊天记录批量写入服务
+
+    消息处理流程只把 ChatLog 放入有界队列，由本服务按数量或时间阈值合并为一次
+    insert_many 写入；数据库过慢导致队列写满时直接丢弃并计数，不阻塞消息处理
+
+    日志引用的长文本在写入日志前先合并写入 ChatText，近期写入过的文本不会重复写入；
+    图片在日志进入队列后才上传，上传完成时日志已写入的，在其所在批次写入后再更新对象名
+    """
+
+    id = "abot/chat_log_writer"
+
+    def __init__(self, max_queue: int = 10000, batch_size: int = 500, interval: float = 2) -> None:
+        super().__init__()
+        self.queue: asyncio.Queue[ChatLog] = asyncio.Queue(max_queue)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self._batch: list[ChatLog] = []
+        self._writing: set[PydanticObjectId | None] = set()
+        self._patches: list[UpdateOne] = []
+        self._interned: TTLCache[str, bool] = TTLCache(maxsize=10000, ttl=3600)
+
+    @property
+    def required(self) -> set[str]:
+        return {"abot/mongodb"}
+
+    @property
+    def stages(self) -> set[str]:
+        return {"blocking", "cleanup"}
+
+    def put(self, log: ChatLog) -> bool:
+        try:
+            self.queue.put_nowait(log)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"[Core.chat_log] 聊天记录队列已满，已丢弃 {self.dropped} 条记录")
+            return False
+        return True
+
+    async def attach_picture(self, log: ChatLog, index: int, name: str) -> None:
+        """补上日志中第 index 个元素（图片）的 S3 对象名"""
+        log.chain[index].v = name
+        if not log.flushed:
+            # 仍在队列中，写入时会带上对象名
+            return
+        patch = UpdateOne({"_id": log.id}, {"$set": {f"chain.{index}.v": name}})
+        if log.id in self._writing:
+            # 所在批次正在写入，等写入完成后再更新
+            self._patches.append(patch)
+            return
+        try:
+            await ChatLog.get_motor_collection().bulk_write([patch])
+        except Exception:
+            logger.exception(f"[Core.chat_log] 更新聊天记录 {log.id} 的图片失败")
+
+    async def _apply_patches(self) -> None:
+        patches, self._patches = self._patches, []
+        if not patches:
+            return
+        try:
+            await ChatLog.get_motor_collection().bulk_write(patches, ordered=False)
+        except Exception:
+            logger.exception(f"[Core.chat_log] {len(patches)} 条聊天记录的图片更新失败")
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "queue_depth": self.queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "last_flush_latency": round(self.last_flush_latency, 4),
+            "max_flush_latency": round(self.max_flush_latency, 4),
+        }
+
+    def _drain(self) -> None:
+        while len(self._batch) < self.batch_size and not self.queue.empty():
+            self._batch.append(self.queue.get_nowait())
+
+    async def _collect(self) -> None:
+        # 收集到的记录保存在 self._batch 中，即使等待被取消也不会丢失
+        if not self._batch:
+            self._batch.append(await self.queue.get())
+        deadline = time.monotonic() + self.interval
+        self._drain()
+        while len(self._batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                self._batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except TimeoutError:
+                break
+            self._drain()
+
+    async def _intern_texts(self, batch: list[ChatLog]) -> None:
+        texts = {
+            text_hash: text
+            for log in batch
+            for text_hash, text in log.pending_texts.items()
+            if not self._interned.get(text_hash, count=False)
+        }
+        if not texts:
+            return
+        # 近期写入过的文本不会刷新 last_seen，最多比实际引用时间早 _interned 的过期时间
+        now = datetime.now()  # noqa: DTZ005
+        requests = [
+            UpdateOne({"_id": h}, {"$set": {"last_seen": now}, "$setOnInsert": {"text": t}}, upsert=True)
+            for h, t in texts.items()
+        ]
+        try:
+            await ChatText.get_motor_collection().bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            # 并发写入同一文本时 upsert 可能出现重复键，此时文本已经存在
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+        for text_hash in texts:
+            self._interned.set(text_hash, True)
+
+    async def flush(self) -> None:
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        for log in batch:
+            log.mark_flushed()
+        self._writing = {log.id for log in batch}
+        try:
+            await self._write(batch)
+        finally:
+            self._writing = set()
+        await self._apply_patches()
+
+    async def _write(self, batch: list[ChatLog]) -> None:
+        start = time.perf_counter()
+        try:
+            await self._intern_texts(batch)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception(f"[Core.chat_log] 聊天文本写入失败，{len(batch)} 条聊天记录未写入")
+            return
+        try:
+            await ChatLog.insert_many(batch, ordered=False)
+            self.written += len(batch)
+        except BulkWriteError as e:
+            failed = len(e.details.get("writeErrors", []))
+            self.written += len(batch) - failed
+            self.failed += failed
+            logger.warning(f"[Core.chat_log] {failed} 条聊天记录写入失败")
+        except Exception:
+            self.failed += len(batch)
+            logger.exception(f"[Core.chat_log] {len(batch)} 条聊天记录写入失败")
+        self.last_flush_latency = time.perf_counter() - start
+        self.max_flush_latency = max(self.max_flush_latency, self.last_flush_latency)
+
+    async def launch(self, launart: Launart) -> None:
+        async with self.stage("blocking"):
+            exit_mark = asyncio.create_task(launart.status.wait_for_sigexit())
+            while not exit_mark.done():
+                collector = asyncio.create_task(self._collect())
+                await asyncio.wait([exit_mark, collector], return_when=asyncio.FIRST_COMPLETED)
+                collector.cancel()
+                await self.flush()
+
+        async with self.stage("cleanup"):
+            while True:
+                self._drain()
+                if not self._batch:
+                    break
+                await self.flush()
+            logger.info(f"[Core.chat_log] 聊天记录已全部写入，{self.stats()}")
@@ -1,10 +1,17 @@
-from typing import TYPE_CHECKING, Literal, cast
+import asyncio
+import contextlib
+from typing import TYPE_CHECKING, Any, Literal, cast
 
 from beanie import Document, init_beanie
 from launart import Launart, Service
 from loguru import logger
 from motor.core import AgnosticDatabase
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure
+
+from utils.config import LogRetentionConfig, MongoPoolConfig
+from utils.db.monitor import MongoMetrics
+from utils.db.transfer import transaction_support
 
 if TYPE_CHECKING:
     from beanie.odm.views import View
@@ -16,9 +23,17 @@ class MongoDBService(Service):
 
     client: "AgnosticDatabase"
 
-    def __init__(self, uri: str = "mongodb://localhost:27017") -> None:
+    def __init__(
+        self,
+        uri: str = "mongodb://localhost:27017",
+        log_retention: LogRetentionConfig | None = None,
+        pool: MongoPoolConfig | None = None,
+    ) -> None:
         super().__init__()
         self.uri = uri
+        self.log_retention = log_retention or LogRetentionConfig()
+        self.pool = pool or MongoPoolConfig()
+        self.metrics = MongoMetrics()
 
     # def get_interface(self, typ: type[AgnosticDatabase]) -> AgnosticDatabase:
     #     return self.client
@@ -29,11 +44,23 @@ class MongoDBService(Service):
 
     @property
     def stages(self) -> set[Literal["preparing", "blocking", "cleanup"]]:
-        return {"preparing"}
+        return {"preparing", "blocking"}
+
+    def _client_options(self) -> dict[str, Any]:
+        options: dict[str, Any] = {
+            "maxPoolSize": self.pool.max_pool_size,
+            "minPoolSize": self.pool.min_pool_size,
+            "event_listeners": [self.metrics],
+        }
+        if self.pool.wait_queue_timeout_ms > 0:
+            options["waitQueueTimeoutMS"] = self.pool.wait_queue_timeout_ms
+        if self.pool.compressors:
+            options["compressors"] = self.pool.compressors
+        return options
 
-    async def launch(self, _: Launart) -> None:
+    async def launch(self, launart: Launart) -> None:
         logger.info("Initializing database...")
-        self.client = AsyncIOMotorClient(self.uri)["abot"]
+        self.client = AsyncIOMotorClient(self.uri, **self._client_options())["abot"]
         document_models = cast(
             list[type["Document"] | type["View"] | str],
             Document.__subclasses__(),
@@ -42,7 +69,57 @@ class MongoDBService(Service):
             database=self.client,
             document_models=document_models,
         )
+        for model in Document.__subclasses__():
+            self.apply_concern(model)
+            if retention_key := getattr(model, "retention_key", None):
+                await self.ensure_ttl_index(model, getattr(self.log_retention, retention_key, 0))
         logger.success("Database initialized!")
 
         async with self.stage("preparing"):
-            ...
+            if not await transaction_support.detect(self.client):
+                logger.warning("[Core.db] 数据库不支持事务，转账将使用补偿方式执行")
+
+        async with self.stage("blocking"):
+            exit_mark = asyncio.create_task(launart.status.wait_for_sigexit())
+            if self.pool.metrics_interval <= 0:
+                await exit_mark
+            while not exit_mark.done():
+                with contextlib.suppress(TimeoutError):
+                    await asyncio.wait_for(asyncio.shield(exit_mark), self.pool.metrics_interval)
+                logger.info(f"[Core.db] 数据库操作统计：\n{self.metrics.summary()}")
+
+    @staticmethod
+    def apply_concern(model: type[Document]) -> None:
+        """按文档类声明的 read_concern / write_concern 替换其集合对象"""
+        read_concern = getattr(model, "read_concern", None)
+        write_concern = getattr(model, "write_concern", None)
+        if read_concern is None and write_concern is None:
+            return
+        settings = model.get_settings()
+        settings.motor_collection = settings.motor_collection.with_options(
+            read_concern=read_concern, write_concern=write_concern
+        )
+
+    async def ensure_ttl_index(self, model: type[Document], days: int) -> None:
+        """按保留天数创建、修改或删除日志的 TTL 索引，重复执行不会产生变化"""
+        collection = model.get_motor_collection()
+        field: str = model.ttl_field  # type: ignore[attr-defined]
+        name = f"{field}_ttl"
+        existing = (await collection.index_information()).get(name)
+        seconds = days * 86400
+        try:
+            if days <= 0:
+                if existing is not None:
+                    await collection.drop_index(name)
+                    logger.info(f"[Core.db] 已移除 {collection.name} 的过期时间")
+            elif existing is None:
+                await collection.create_index(field, name=name, expireAfterSeconds=seconds)
+                logger.info(f"[Core.db] 已为 {collection.name} 设置 {days} 天的过期时间")
+            elif existing.get("expireAfterSeconds") != seconds:
+                await self.client.command(
+                    "collMod", collection.name, index={"name": name, "expireAfterSeconds": seconds}
+                )
+                logger.info(f"[Core.db] 已将 {collection.name} 的过期时间修改为 {days} 天")
+        except OperationFailure as e:
+            # 已存在同一字段的其他索引等冲突，不影响启动
+            logger.warning(f"[Core.db] 无法设置 {collection.name} 的过期时间：{e}")
@@ -0,0 +1,146 @@
+import asyncio
+import random
+import time
+from base64 import b64encode
+from collections import deque
+from datetime import datetime
+
+from aiohttp import ClientError, ClientTimeout
+from beanie.odm.operators.find.comparison import GT, NE, Eq
+from launart import Launart, Service
+from loguru import logger
+
+from utils.datetime import CHINA_TZ
+from utils.db import Advertisement
+
+from .aiohttp import AiohttpClientService
+from .s3file import S3FileService
+
+HITOKOTO_URL = "https://v1.hitokoto.cn/?encode=text"
+# 一言接口不可用时使用的备用语录
+FALLBACK_QUOTES = (
+    "生活明朗，万物可爱。",
+    "人生如逆旅，我亦是行人。",
+    "山高自有客行路，水深自有渡船人。",
+    "不积跬步，无以至千里。",
+    "路漫漫其修远兮，吾将上下而求索。",
+    "纸上得来终觉浅，绝知此事要躬行。",
+    "星光不问赶路人，时光不负有心人。",
+    "世上无难事，只要肯登攀。",
+    "长风破浪会有时，直挂云帆济沧海。",
+    "欲穷千里目，更上一层楼。",
+    "行到水穷处，坐看云起时。",
+    "且将新火试新茶，诗酒趁年华。",
+)
+
+
+class FooterPrefetchService(Service):
+    """在后台预取图片页脚的内容，渲染时不再发起网络请求
+
+    维护一个滚动更新的一言池，以及按 ad.content 缓存的图片广告 data URI；
+    缓存中没有的图片广告会在下一次刷新时下载，刷新失败时继续使用已有内容和备用语录
+    """
+
+    id = "abot/footer_prefetch"
+
+    def __init__(self, interval: float = 600, pool_size: int = 50, refill: int = 10) -> None:
+        super().__init__()
+        self.interval = interval
+        self.refill = refill
+        self.quotes: deque[str] = deque(maxlen=pool_size)
+        self.ad_images: dict[str, str] = {}
+        self._missing: set[str] = set()
+        self._failed: set[str] = set()
+        self._wakeup = asyncio.Event()
+
+    @property
+    def required(self) -> set[str]:
+        return {"http.client/aiohttp", "abot/s3file", "abot/mongodb"}
+
+    @property
+    def stages(self) -> set[str]:
+        return {"blocking"}
+
+    def quote(self) -> str:
+        return random.choice(self.quotes or FALLBACK_QUOTES)
+
+    def ad_image(self, content: str) -> str | None:
+        """返回图片广告的 data URI，尚未缓存时返回 None 并安排下载"""
+        if (data_uri := self.ad_images.get(content)) is None and content not in self._missing | self._failed:
+            self._missing.add(content)
+            self._wakeup.set()
+        return data_uri
+
+    async def _fetch_quotes(self, launart: Launart) -> None:
+        session = launart.get_component(AiohttpClientService).session
+        timeout = ClientTimeout(total=5)
+        for _ in range(self.refill):
+            try:
+                async with session.get(HITOKOTO_URL, timeout=timeout) as resp:
+                    resp.raise_for_status()
+                    if text := (await resp.text()).strip():
+                        self.quotes.append(text)
+            except (ClientError, TimeoutError) as e:
+                logger.warning(f"[Util.t2i] 获取一言失败：{e!r}")
+                return
+
+    async def _fetch_ad_images(self, launart: Launart, *, full: bool) -> None:
+        missing = set(self._missing)
+        contents = set()
+        if full:
+            self._failed.clear()
+            contents = {
+                ad.content
+                async for ad in Advertisement.find(
+                    Eq(Advertisement.is_active, True),
+                    NE(Advertisement.content_type, 0),
+                    GT(Advertisement.end_date, datetime.now(CHINA_TZ)),
+                )
+            }
+            # 已下线的广告不再缓存
+            for content in set(self.ad_images) - contents - missing:
+                del self.ad_images[content]
+        s3file = launart.get_component(S3FileService).s3file
+        for content in (contents | missing) - set(self.ad_images):
+            try:
+                resp = await s3file.get_object(content)
+                self.ad_images[content] = f"data:image/png;base64,{b64encode(await resp.read()).decode()}"
+            except Exception as e:
+                self._failed.add(content)
+                logger.warning(f"[Util.t2i] 下载广告图片 {content} 失败：{e!r}")
+        self._missing -= missing
+
+    async def refresh(self, launart: Launart, *, full: bool = True) -> None:
+        self._wakeup.clear()
+        if full:
+            try:
+                await self._fetch_quotes(launart)
+            except Exception:
+                logger.exception("[Util.t2i] 刷新一言池失败")
+        try:
+            await self._fetch_ad_images(launart, full=full)
+        except Exception:
+            logger.exception("[Util.t2i] 刷新广告图片缓存失败")
+        logger.debug(f"[Util.t2i] 页脚内容已刷新：一言 {len(self.quotes)} 条，广告图片 {len(self.ad_images)} 张")
+
+    async def launch(self, launart: Launart) -> None:
+        async with self.stage("blocking"):
+            exit_mark = asyncio.create_task(launart.status.wait_for_sigexit())
+            next_full = 0.0
+            while not exit_mark.done():
+                # 定时全量刷新，渲染时遇到未缓存的图片广告则只下载这些图片
+                full = time.monotonic() >= next_full
+                try:
+                    await self.refresh(launart, full=full)
+                except Exception:
+                    # 刷新失败时继续使用已有内容，等待下一次刷新
+                    logger.exception("[Util.t2i] 刷新页脚内容失败")
+                if full:
+                    next_full = time.monotonic() + self.interval
+                waiter = asyncio.create_task(self._wakeup.wait())
+                await asyncio.wait(
+                    [exit_mark, waiter],
+                    timeout=max(next_full - time.monotonic(), 0),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                waiter.cancel()
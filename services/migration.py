@@ -0,0 +1,36 @@
+import asyncio
+
+from launart import Launart, Service
+from loguru import logger
+
+from utils.db import MIGRATIONS, MigrationRunner
+
+
+class MigrationService(Service):
+    """在后台执行数据迁移，退出时中断的迁移会在下次启动时从保存的进度继续"""
+
+    id = "abot/migration"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.runner = MigrationRunner(MIGRATIONS)
+
+    @property
+    def required(self) -> set[str]:
+        return {"abot/mongodb"}
+
+    @property
+    def stages(self) -> set[str]:
+        return {"blocking"}
+
+    async def launch(self, launart: Launart) -> None:
+        async with self.stage("blocking"):
+            exit_mark = asyncio.create_task(launart.status.wait_for_sigexit())
+            task = asyncio.create_task(self.runner.run())
+            await asyncio.wait([exit_mark, task], return_when=asyncio.FIRST_COMPLETED)
+            if not task.done():
+                task.cancel()
+                logger.info("[Core.migration] 数据迁移已暂停，将在下次启动时继续")
+            elif task.exception():
+                logger.opt(exception=task.exception()).error("[Core.migration] 数据迁移失败")
+            await exit_mark
@@ -0,0 +1,38 @@
+import asyncio
+
+from launart import Launart, Service
+from loguru import logger
+
+from utils.page_pool import PagePool
+from utils.render_cache import RenderCache
+
+
+class PagePoolService(Service):
+    """在 Playwright 启动后预热页面池并清理过期的渲染缓存，退出时关闭池中的页面"""
+
+    id = "abot/page_pool"
+
+    def __init__(self, pool: PagePool, cache: RenderCache | None = None) -> None:
+        super().__init__()
+        self.pool = pool
+        self.cache = cache
+
+    @property
+    def required(self) -> set[str]:
+        return {"web.render/graiax.playwright"}
+
+    @property
+    def stages(self) -> set[str]:
+        return {"preparing", "cleanup"}
+
+    async def launch(self, launart: Launart) -> None:
+        async with self.stage("preparing"):
+            await self.pool.start(launart)
+            if self.cache is not None:
+                await asyncio.to_thread(self.cache.prune)
+
+        async with self.stage("cleanup"):
+            logger.info(f"[Util.t2i] 页面池统计：{self.pool.summary()}")
+            if self.cache is not None:
+                logger.info(f"[Util.t2i] 渲染缓存统计：{self.cache.summary()}")
+            await self.pool.close()
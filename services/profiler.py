@@ -0,0 +1,44 @@
+import asyncio
+from pathlib import Path
+from typing import Literal
+
+from launart import Launart, Service
+from loguru import logger
+
+from services.database import MongoDBService
+from utils.db.profiler import QueryProfiler
+
+
+class QueryProfilerService(Service):
+    """开发模式下的查询分析服务，退出时对慢查询执行 explain 并写出分析报告"""
+
+    id = "abot/query_profiler"
+
+    def __init__(self, report_path: Path, slow_ms: float = 50, repeat_threshold: int = 5) -> None:
+        super().__init__()
+        self.report_path = report_path
+        self.profiler = QueryProfiler(slow_ms, repeat_threshold)
+        # 需要在 MongoDBService 创建客户端之前注册监听器
+        self.profiler.install()
+
+    @property
+    def required(self) -> set[str]:
+        return {"abot/mongodb"}
+
+    @property
+    def stages(self) -> set[Literal["preparing", "blocking", "cleanup"]]:
+        return {"cleanup"}
+
+    async def write_report(self) -> Path:
+        database = Launart.current().get_component(MongoDBService).client
+        await self.profiler.explain_slow(database)
+        report = self.profiler.report()
+        self.report_path.parent.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(self.report_path.write_text, report, "utf-8")
+        return self.report_path
+
+    async def launch(self, _: Launart) -> None:
+        logger.warning("[Core.db] 查询分析器已启用，会影响数据库操作的性能")
+        async with self.stage("cleanup"):
+            path = await self.write_report()
+            logger.info(f"[Core.db] 查询分析报告已写入 {path}")
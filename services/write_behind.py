@@ -0,0 +1,52 @@
+import asyncio
+
+from launart import Launart, Service
+from loguru import logger
+
+from utils.db import CounterBuffer, LogBuffer
+
+
+class WriteBehindService(Service):
+    id = "abot/write_behind"
+
+    def __init__(self, *buffers: CounterBuffer | LogBuffer, interval: float = 10) -> None:
+        super().__init__()
+        self.buffers = buffers
+        self.interval = interval
+
+    @property
+    def required(self) -> set[str]:
+        return {"abot/mongodb"}
+
+    @property
+    def stages(self) -> set[str]:
+        return {"blocking", "cleanup"}
+
+    async def flush(self) -> None:
+        for buffer in self.buffers:
+            try:
+                await buffer.flush()
+            except Exception as e:
+                # 失败的增量会保留在缓冲区中，由下一次写入重试
+                logger.warning(f"[Core.db] {buffer.document.__name__} 写回失败，将在下一次写入时重试：{e!r}")
+
+    async def _wait_any_full(self) -> None:
+        waiters = [asyncio.create_task(buffer.wait_full()) for buffer in self.buffers]
+        try:
+            await asyncio.wait(waiters, timeout=self.interval, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    async def launch(self, launart: Launart) -> None:
+        async with self.stage("blocking"):
+            exit_mark = asyncio.create_task(launart.status.wait_for_sigexit())
+            while not exit_mark.done():
+                waiter = asyncio.create_task(self._wait_any_full())
+                await asyncio.wait([exit_mark, waiter], return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                await self.flush()
+
+        async with self.stage("cleanup"):
+            await self.flush()
+            logger.info("[Core.db] 写回缓冲已全部写入")
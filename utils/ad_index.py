@@ -0,0 +1,147 @@
+import asyncio
+import math
+import random
+import time
+from collections import defaultdict
+from datetime import UTC, datetime
+
+import numpy as np
+from beanie.odm.operators.find.comparison import GT, Eq
+from loguru import logger
+
+from models.ad import AdvertisementCategory
+from utils.cache import register_invalidation
+from utils.datetime import CHINA_TZ
+from utils.db import Advertisement
+
+
+def _timestamp(value: datetime) -> float:
+    # 从数据库读出的时间不带时区，为 UTC 时间
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=UTC)
+    try:
+        return value.timestamp()
+    except (OverflowError, ValueError):
+        return math.inf
+
+
+class AliasTable:
+    """Walker 别名表，构建 O(n)，按权重抽样 O(1)"""
+
+    def __init__(self, ads: list[Advertisement], weights: np.ndarray) -> None:
+        n = len(ads)
+        self.ads = ads
+        self.total = float(weights.sum())
+        prob = weights * n / self.total
+        alias = np.zeros(n, dtype=np.int64)
+        small = list(np.flatnonzero(prob < 1))
+        large = list(np.flatnonzero(prob >= 1))
+        while small and large:
+            s, g = small.pop(), large.pop()
+            alias[s] = g
+            prob[g] -= 1 - prob[s]
+            (small if prob[g] < 1 else large).append(g)
+        # 剩余的条目只受浮点误差影响，概率视为 1
+        prob[small + large] = 1
+        self.prob = prob
+        self.alias = alias
+
+    def sample(self) -> Advertisement:
+        i = random.randrange(len(self.ads))
+        return self.ads[i] if random.random() < self.prob[i] else self.ads[self.alias[i]]
+
+
+class AdIndex:
+    """生效中广告的内存索引
+
+    按分类以及 (分类, 受众) 倒排分组，每组预先构建别名表，抽取广告时不查询数据库；
+    索引每隔 refresh_interval 秒或收到缓存失效通知后在后台重新加载，
+    广告的开始和结束时间在内存中判断，到达最近的时间点时只用已加载的广告重建别名表
+    """
+
+    def __init__(self, refresh_interval: float = 300) -> None:
+        self.refresh_interval = refresh_interval
+        self._ads: list[Advertisement] = []
+        self._tables: dict[tuple[AdvertisementCategory | None, str | None], AliasTable] = {}
+        self._next_change = math.inf
+        self._loaded_at: float | None = None
+        self._dirty = False
+        self._refreshing: asyncio.Task | None = None
+
+    def mark_dirty(self) -> None:
+        self._dirty = True
+
+    async def refresh(self) -> None:
+        self._dirty = False
+        self._ads = await Advertisement.find(
+            Eq(Advertisement.is_active, True), GT(Advertisement.end_date, datetime.now(CHINA_TZ))
+        ).to_list()
+        self._loaded_at = time.monotonic()
+        self._rebuild(time.time())
+        logger.debug(f"[Util.ad] 广告索引已刷新，共 {len(self._ads)} 条广告")
+
+    async def _background_refresh(self) -> None:
+        try:
+            await self.refresh()
+        except Exception:
+            # 刷新失败时继续使用已加载的索引
+            logger.exception("[Util.ad] 广告索引刷新失败")
+
+    def _rebuild(self, now: float) -> None:
+        self._ads = [ad for ad in self._ads if _timestamp(ad.end_date) > now]
+        live = [ad for ad in self._ads if _timestamp(ad.start_date) <= now]
+        upcoming = [_timestamp(ad.start_date) for ad in self._ads if _timestamp(ad.start_date) > now]
+        self._next_change = min([_timestamp(ad.end_date) for ad in live] + upcoming, default=math.inf)
+
+        groups: defaultdict[tuple[AdvertisementCategory | None, str | None], list[int]] = defaultdict(list)
+        for i, ad in enumerate(live):
+            for category in (None, ad.ad_category):
+                groups[category, None].append(i)
+                for audience in set(ad.target_audience):
+                    groups[category, audience].append(i)
+        weights = np.log1p([ad.bid_price for ad in live]) * np.log1p([ad.weight for ad in live])
+        tables = {}
+        for key, indexes in groups.items():
+            # 权重为 0 的广告不会被抽中
+            group_weights = weights[indexes]
+            if group_weights.sum() > 0:
+                tables[key] = AliasTable([live[i] for i in indexes], group_weights)
+        self._tables = tables
+
+    async def _ensure_fresh(self) -> None:
+        if self._loaded_at is None:
+            await self.refresh()
+            return
+        stale = self._dirty or time.monotonic() - self._loaded_at >= self.refresh_interval
+        if stale and (self._refreshing is None or self._refreshing.done()):
+            self._refreshing = asyncio.create_task(self._background_refresh())
+        if time.time() >= self._next_change:
+            self._rebuild(time.time())
+
+    async def get(
+        self, category: AdvertisementCategory | None = None, target_audience: list[str] | None = None
+    ) -> Advertisement | None:
+        """按 log1p(出价) * log1p(权重) 随机抽取一条广告，指定受众时只抽取面向其中任一受众的广告"""
+        await self._ensure_fresh()
+        if not target_audience:
+            table = self._tables.get((category, None))
+            return table.sample() if table else None
+
+        requested = set(target_audience)
+        tables = [table for audience in requested if (table := self._tables.get((category, audience)))]
+        if not tables:
+            return None
+        if len(tables) == 1:
+            return tables[0].sample()
+        # 先按总权重选择受众分组再抽样，面向多个请求受众的广告会被多个分组包含，
+        # 以 1 / 分组数 的概率接受，使每条广告被抽中的概率与其权重成正比
+        totals = [table.total for table in tables]
+        while True:
+            ad = random.choices(tables, weights=totals)[0].sample()
+            if random.random() * len(requested & set(ad.target_audience)) < 1:
+                return ad
+
+
+ad_index = AdIndex()
+# 广告的浏览量由写回缓冲更新，不需要重新加载索引
+register_invalidation(Advertisement, lambda _: ad_index.mark_dirty(), ignore_fields={"views"})
@@ -0,0 +1,192 @@
+import asyncio
+import gzip
+import io
+from collections.abc import Awaitable, Callable, Iterator
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Any
+
+from beanie import Document
+from bson import ObjectId, json_util
+from loguru import logger
+
+from utils.datetime import CHINA_TZ
+
+if TYPE_CHECKING:
+    from services import S3File
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS
+SEGMENT_SUFFIXES = (".ndjson.zst", ".ndjson.gz")
+
+
+def default_suffix() -> str:
+    return SEGMENT_SUFFIXES[0] if zstandard is not None else SEGMENT_SUFFIXES[1]
+
+
+def open_writer(path: Path) -> IO[bytes]:
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).stream_writer(path.open("wb"), closefd=True)
+    return gzip.open(path, "wb")
+
+
+def open_reader(path: Path) -> IO[str]:
+    if path.name.endswith(".zst"):
+        if zstandard is None:
+            msg = f"读取 {path} 需要安装 zstandard"
+            raise RuntimeError(msg)
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(path.open("rb"), closefd=True), "utf-8")
+    return gzip.open(path, "rt", encoding="utf-8")
+
+
+def _partition(oid: ObjectId) -> date:
+    return oid.generation_time.astimezone(CHINA_TZ).date()
+
+
+class _Segment:
+    """一个归档分段文件，同一分段内的文档属于同一天，写完后从临时文件改名为正式文件"""
+
+    def __init__(self, root: Path, day: date, first_id: ObjectId) -> None:
+        suffix = default_suffix()
+        directory = root / f"{day:%Y}" / f"{day:%m}" / f"{day:%d}"
+        directory.mkdir(parents=True, exist_ok=True)
+        self.day = day
+        self.path = directory / f"{first_id}{suffix}"
+        self.first_id = first_id
+        self.last_id = first_id
+        self.count = 0
+        self._tmp = self.path.with_name(f"{self.path.name}.tmp")
+        self._writer = open_writer(self._tmp)
+
+    def write(self, docs: list[dict]) -> None:
+        for doc in docs:
+            self._writer.write(json_util.dumps(doc, json_options=JSON_OPTIONS).encode() + b"\n")
+        self.last_id = docs[-1]["_id"]
+        self.count += len(docs)
+
+    def close(self) -> None:
+        self._writer.close()
+        self._tmp.replace(self.path)
+
+
+class LogArchiver:
+    """将日志集合中的旧文档导出为按天分区的压缩 NDJSON 分段，并从数据库中删除
+
+    文档按 _id 顺序经游标流式读取，每次只在内存中保留一批文档；
+    分段文件完整写入磁盘（以及可选的上传到 S3）后才按 _id 范围删除对应的文档；
+    prepare 会在每批文档写入分段前调用，用于把文档引用的其他集合的数据内联进来
+    """
+
+    def __init__(
+        self,
+        document: type[Document],
+        root: Path,
+        *,
+        batch_size: int = 1000,
+        segment_size: int = 100000,
+        s3file: "S3File | None" = None,
+        prepare: Callable[[list[dict]], Awaitable[None]] | None = None,
+    ) -> None:
+        self.document = document
+        self.collection_name = document.get_settings().name
+        self.root = root / self.collection_name
+        self.batch_size = batch_size
+        self.segment_size = segment_size
+        self.s3file = s3file
+        self.prepare = prepare
+
+    async def _finish(self, segment: _Segment) -> None:
+        await asyncio.to_thread(segment.close)
+        if self.s3file is not None:
+            object_name = f"archive/{segment.path.relative_to(self.root.parent).as_posix()}"
+            await self.s3file.put_object(
+                object_name, await asyncio.to_thread(segment.path.read_bytes), o_type="archive"
+            )
+        result = await self.document.get_motor_collection().delete_many(
+            {"_id": {"$gte": segment.first_id, "$lte": segment.last_id}}
+        )
+        logger.info(
+            f"[Core.archive] {self.collection_name} {segment.day} 已归档 {segment.count} 条，"
+            f"删除 {result.deleted_count} 条：{segment.path}"
+        )
+
+    async def archive(self, older_than_days: int) -> int:
+        """归档 older_than_days 天之前写入的文档，返回归档的文档数"""
+        cutoff = ObjectId.from_datetime(datetime.now(CHINA_TZ) - timedelta(days=older_than_days))
+        cursor = (
+            self.document.get_motor_collection()
+            .find({"_id": {"$lt": cutoff}})
+            .sort("_id", 1)
+            .batch_size(self.batch_size)
+        )
+        total = 0
+        segment: _Segment | None = None
+        batch: list[dict] = []
+
+        async def write_batch() -> None:
+            if batch:
+                if self.prepare is not None:
+                    await self.prepare(batch)
+                await asyncio.to_thread(segment.write, batch.copy())  # type: ignore[union-attr]
+                batch.clear()
+
+        async for doc in cursor:
+            day = _partition(doc["_id"])
+            if segment is not None and (segment.day != day or segment.count + len(batch) >= self.segment_size):
+                await write_batch()
+                await self._finish(segment)
+                segment = None
+            if segment is None:
+                segment = await asyncio.to_thread(_Segment, self.root, day, doc["_id"])
+            batch.append(doc)
+            total += 1
+            if len(batch) >= self.batch_size:
+                await write_batch()
+        if segment is not None:
+            await write_batch()
+            await self._finish(segment)
+        return total
+
+
+def _as_aware(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=CHINA_TZ)
+
+
+def scan_archive(
+    root: Path,
+    collection_name: str,
+    *,
+    key_field: str = "qid",
+    key: str | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+) -> Iterator[dict[str, Any]]:
+    """按键和写入时间范围读取归档，只会打开时间范围内的分区
+
+    时间范围以文档 _id 的生成时间为准，不带时区的时间视为北京时间
+    """
+    start = _as_aware(start) if start else None
+    end = _as_aware(end) if end else None
+    base = root / collection_name
+    if not base.exists():
+        return
+    for path in sorted(p for p in base.glob("*/*/*/*") if p.name.endswith(SEGMENT_SUFFIXES)):
+        year, month, day = path.parts[-4:-1]
+        partition = date(int(year), int(month), int(day))
+        if (start and partition < start.astimezone(CHINA_TZ).date()) or (
+            end and partition > end.astimezone(CHINA_TZ).date()
+        ):
+            continue
+        with open_reader(path) as reader:
+            for line in reader:
+                doc = json_util.loads(line, json_options=JSON_OPTIONS)
+                if key is not None and doc.get(key_field) != key:
+                    continue
+                created = doc["_id"].generation_time
+                if (start and created < start) or (end and created >= end):
+                    continue
+                yield doc
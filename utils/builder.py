@@ -1,20 +1,43 @@
-import math
-import random
 from datetime import datetime, timedelta
 from secrets import token_hex
-from typing import TYPE_CHECKING, Literal, cast
+from typing import Literal
 
 from avilla.core import Context
 from beanie import SortDirection
-from beanie.odm.operators.find.comparison import GT, LTE, Eq, In
+from beanie.odm.operators.find.comparison import Eq
 from loguru import logger
+from pymongo.errors import DuplicateKeyError
 
 from models.ad import AdvertisementCategory
-from utils.datetime import CHINA_TZ
-from utils.db import AdDisplayLog, Advertisement, AUser, BanLog, GroupData
+from utils.ad_index import ad_index
+from utils.cache import TTLCache, register_invalidation
+from utils.datetime import CHINA_TZ, current_day
+from utils.db import (
+    AdDisplayLog,
+    Advertisement,
+    AUser,
+    GroupData,
+    SequenceAllocator,
+    ad_display_buffer,
+    ad_view_counter,
+)
 
-if TYPE_CHECKING:
-    from models.saya import FuncItem
+# 进程内的身份缓存，命中时直接返回同一个文档实例，避免每条消息重复查询数据库
+# 数据库中的文档被其他进程修改时由 CacheInvalidationService 使缓存失效
+user_cache: TTLCache[str, AUser] = TTLCache(maxsize=4096, ttl=3600)
+group_cache: TTLCache[str, GroupData] = TTLCache(maxsize=1024, ttl=3600)
+
+# AUser 的修改都带有来源标记，本进程的修改已同步到缓存的实例中，其他进程或直接修改数据库时使缓存失效
+register_invalidation(AUser, lambda doc_id: user_cache.evict(lambda user: doc_id is None or user.id == doc_id))
+register_invalidation(GroupData, lambda doc_id: group_cache.evict(lambda group: doc_id is None or group.id == doc_id))
+
+
+async def _max_aid() -> int:
+    last_user = await AUser.find_one(sort=[("aid", SortDirection.DESCENDING)])
+    return int(last_user.aid) if last_user else 0
+
+
+aid_sequence = SequenceAllocator("aid", seed=_max_aid)
 
 
 class ADBuilder(Advertisement):
@@ -32,62 +55,40 @@ class ADBuilder(Advertisement):
     ) -> str:
         if target_audience is None:
             target_audience = []
+        end_date = datetime.now(CHINA_TZ) + timedelta(days=expire_days) if expire_days else datetime.max
+        # 广告编号保持随机，避免可以被枚举；ad_id 有唯一索引，重复时重新生成
         while True:
             ad_id = token_hex(8)
-            if await cls.find_one(cls.ad_id == ad_id):
+            try:
+                await cls.insert(
+                    Advertisement(
+                        ad_id=ad_id,
+                        content=content,
+                        content_type=content_type,
+                        ad_category=category,
+                        source=source,
+                        end_date=end_date,
+                        weight=weight,
+                        target_audience=target_audience,
+                        bid_price=bid_price,
+                    )
+                )
+            except DuplicateKeyError:
                 continue
-            break
-
-        await cls.insert(
-            Advertisement(
-                ad_id=ad_id,
-                content=content,
-                content_type=content_type,
-                ad_category=category,
-                source=source,
-                end_date=datetime.now(CHINA_TZ) + timedelta(days=expire_days) if expire_days else datetime.max,
-                weight=weight,
-                target_audience=target_audience,
-                bid_price=bid_price,
-            )
-        )
-        return ad_id
+            return ad_id
 
     # 随机抽取广告
     @classmethod
     async def get_ad(
         cls, category: AdvertisementCategory | None = None, target_audience: list[str] | None = None
     ) -> Advertisement | None:
+        """从内存中的广告索引抽取广告，浏览量和展示日志由写回缓冲写入数据库"""
         if target_audience is None:
             target_audience = []
-        current_date = datetime.now(CHINA_TZ)
-
-        # 构建查询条件
-        query = cls.find(
-            Eq(cls.is_active, True),
-            LTE(cls.start_date, current_date),
-            GT(cls.end_date, current_date),
-        )
-
-        if category:
-            query = query.find(Eq(cls.ad_category, category))
-
-        if target_audience:
-            query = query.find(In(cls.target_audience, target_audience))
-
-        # 计算每个广告的调整后的权重
-        ads = await query.to_list()
-
-        if not ads:
+        selected_ad = await ad_index.get(category, target_audience)
+        if selected_ad is None:
             return None
 
-        adjusted_weights = [math.log1p(ad.bid_price) * math.log1p(ad.weight) for ad in ads]
-        total_weight = sum(adjusted_weights)
-
-        # 根据权重随机选择广告
-        probabilities = [w / total_weight for w in adjusted_weights]
-        selected_ad = random.choices(ads, weights=probabilities, k=1)
-
         ctx = Context.current
         cid = ctx.client.last_value
         if ctx.scene.path_without_land in {"guild.channel", "guild.user"}:
@@ -95,12 +96,9 @@ class ADBuilder(Advertisement):
         else:
             sid = ctx.scene["group"]
 
-        selected_ad = selected_ad[0]
         selected_ad.views += 1
-        await selected_ad.save()  # type: ignore
-        selected_ad = cast(Advertisement, selected_ad)
-
-        await AdDisplayLog.insert(
+        ad_view_counter.inc(selected_ad.ad_id, "views")
+        ad_display_buffer.append(
             AdDisplayLog(
                 ad_id=selected_ad.ad_id,
                 scene_id=sid,
@@ -113,74 +111,67 @@ class ADBuilder(Advertisement):
 
 class AGroupBuilder(GroupData):
     @classmethod
-    async def init(cls, group: GroupData | str | int) -> GroupData:
-        if isinstance(group, str | int):
-            group_id = str(group)
-        elif not isinstance(group, GroupData):
-            msg = f"无法识别的群组类型: {type(group)}"
-            raise TypeError(msg)
-        else:
-            group_id = group.group_id
+    async def fetch(cls, group_id: str) -> GroupData:
+        """按群号获取群数据，不存在时自动初始化，结果会进入身份缓存"""
+        if group := group_cache.get(group_id):
+            return group
+        group = await GroupData.find_one(Eq(GroupData.group_id, group_id))
+        if group is None:
+            group = GroupData(group_id=group_id)
+            try:
+                await group.insert()  # type: ignore
+                logger.info(f"[Core.db] 已初始化群: {group_id}")
+            except DuplicateKeyError:
+                # 并发初始化时由另一处完成了插入
+                group = await GroupData.find_one(Eq(GroupData.group_id, group_id))
+                if group is None:
+                    msg = f"未找到群: {group_id}"
+                    raise ValueError(msg) from None
+        group_cache.set(group_id, group)
+        return group
 
+    @classmethod
+    async def init(cls, group: GroupData | str | int) -> GroupData:
         if isinstance(group, GroupData):
             return group
-        group_ = await GroupData.find_one(Eq(GroupData.group_id, group_id))
-        if group is None:
-            await cls.insert(GroupData(group_id=group_id))
-            group_ = await GroupData.find_one(Eq(GroupData.group_id, group_id))
-            logger.info(f"[Core.db] 已初始化群: {group_id}")
-
-            return cast(GroupData, group_)
-        return cast(GroupData, group_)
-
-    async def ban(self, reason: str, source: str) -> bool:
-        if self.banned:
-            return False
-        self.banned = True
-        await GroupData.save()  # type: ignore
-        await BanLog.insert(
-            BanLog(
-                target_id=self.group_id,
-                target_type="group",
-                action="ban",
-                ban_reason=reason,
-                ban_source=source,
-            )
-        )
-        return True
-
-    async def unban(self, reason: str, source: str) -> bool:
-        if not self.banned:
-            return False
-        self.banned = False
-        await GroupData.save()  # type: ignore
-        await BanLog.insert(
-            BanLog(
-                target_id=self.group_id,
-                target_type="group",
-                action="unban",
-                ban_reason=reason,
-                ban_source=source,
-            )
-        )
-        return True
+        if not isinstance(group, str | int):
+            msg = f"无法识别的群组类型: {type(group)}"
+            raise TypeError(msg)
+        return await cls.fetch(str(group))
 
-    async def disable_function(self, function: str, meta: "FuncItem") -> bool:
-        if function in self.disable_functions or not meta.can_be_disabled:
-            return False
-        self.disable_functions.append(function)
-        await GroupData.save()  # type: ignore
-        return True
 
-    async def enable_function(self, function: str, meta: "FuncItem") -> bool:
-        if function not in self.disable_functions or meta.maintain:
-            return False
-        self.disable_functions.remove(function)
-        await GroupData.save()  # type: ignore
-        return True
+class AUserBuilder(AUser):
+    @classmethod
+    def _cached(cls, user: AUser) -> AUser:
+        """将查询到的用户放入缓存，若缓存中已有该用户则返回缓存中的实例，保证同一用户只有一个活动文档"""
+        if cached := user_cache.get(user.cid, count=False):
+            return cached
+        user_cache.set(user.cid, user)
+        return user
 
+    @classmethod
+    async def fetch(cls, cid: str) -> AUser:
+        """按 cid 获取用户，不存在时自动初始化，结果会进入身份缓存"""
+        if user := user_cache.get(cid):
+            await user.rollover()
+            return user
+        user = await AUser.find_without_data({"cid": cid})
+        if user is None:
+            aid = await aid_sequence.next()
+            user = AUser(aid=aid, cid=cid, day_epoch=current_day())
+            try:
+                await user.insert()  # type: ignore
+                logger.info(f"[Core.db] 已初始化用户: [{aid}] {cid}")
+            except DuplicateKeyError:
+                # 并发初始化时由另一处完成了插入
+                user = await AUser.find_without_data({"cid": cid})
+                if user is None:
+                    msg = f"未找到用户: {cid}"
+                    raise ValueError(msg) from None
+        user = cls._cached(user)
+        await user.rollover()
+        return user
 
-class AUserBuilder(AUser):
     @classmethod
     async def get_user(cls, user: AUser | str | int, create_type: Literal["cid", "aid"] = "cid") -> AUser | None:
         if isinstance(user, str | int):
@@ -197,12 +188,19 @@ class AUserBuilder(AUser):
         if isinstance(user, AUser):
             return user
         if create_type == "cid":
-            user_: AUser | None = await AUser.find_one(Eq(AUser.cid, user_id))
+            if cached := user_cache.get(user_id):
+                await cached.rollover()
+                return cached
+            user_: AUser | None = await AUser.find_without_data({"cid": user_id})
         elif create_type == "aid":
-            user_: AUser | None = await AUser.find_one(Eq(AUser.aid, int(user_id)))
+            user_: AUser | None = await AUser.find_without_data({"aid": int(user_id)})
         else:
             msg = f"无法识别的用户类型: {create_type}"
             raise TypeError(msg)
+        if user_ is None:
+            return None
+        user_ = cls._cached(user_)
+        await user_.rollover()
         return user_
 
     @classmethod
@@ -221,17 +219,14 @@ class AUserBuilder(AUser):
         if isinstance(user, AUser):
             return user
         if create_type == "cid":
-            user_ = await AUser.find_one(Eq(AUser.cid, user_id))
-        elif create_type == "aid":
-            user_ = await AUser.find_one(Eq(AUser.aid, int(user_id)))
-        else:
-            msg = f"无法识别的用户类型: {create_type}"
-            raise TypeError(msg)
-        if user_ is None:
-            last_userid = await AUser.find_one(sort=[("_id", SortDirection.DESCENDING)])
-            aid = int(last_userid.aid) + 1 if last_userid else 1
-            await AUser.insert(AUser(aid=aid, cid=user_id))
-            user_ = await AUser.find_one(Eq(AUser.aid, aid))
-            logger.info(f"[Core.db] 已初始化用户: {user_id}")
-            return cast(AUser, user_)
-        return cast(AUser, user_)
+            return await cls.fetch(user_id)
+        if create_type == "aid":
+            user_ = await AUser.find_without_data({"aid": int(user_id)})
+            if user_ is None:
+                msg = f"未找到用户: AID {user_id}"
+                raise ValueError(msg)
+            user_ = cls._cached(user_)
+            await user_.rollover()
+            return user_
+        msg = f"无法识别的用户类型: {create_type}"
+        raise TypeError(msg)
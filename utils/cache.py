@@ -0,0 +1,145 @@
+import itertools
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from secrets import token_hex
+from typing import TYPE_CHECKING, Any, Generic, TypeVar
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from beanie import Document
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """带过期时间的 LRU 缓存，超出容量时淘汰最久未使用的条目"""
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 300) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return self.get(key, count=False) is not None
+
+    def get(self, key: K, *, count: bool = True) -> V | None:
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            if count:
+                self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        if count:
+            self.hits += 1
+        return item[1]
+
+    def set(self, key: K, value: V) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K) -> V | None:
+        item = self._data.pop(key, None)
+        return None if item is None else item[1]
+
+    def evict(self, predicate: Callable[[V], bool]) -> int:
+        """淘汰所有满足条件的条目，返回淘汰数量"""
+        keys = [k for k, (_, v) in self._data.items() if predicate(v)]
+        for k in keys:
+            del self._data[k]
+        return len(keys)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 4),
+        }
+
+
+# 本进程写入文档时附带的来源标记，CacheInvalidationService 据此跳过本进程自己的修改
+ORIGIN_FIELD = "_origin"
+PROCESS_ORIGIN = token_hex(8)
+_origin_seq = itertools.count()
+
+
+def origin_stamp() -> dict[str, str]:
+    """返回标记本进程写入的字段
+
+    每次的值都不同，保证该字段一定出现在 change stream 的 updatedFields 中；
+    只有已经同步到进程内文档实例的修改才应带上该标记，其余修改需要让缓存失效
+    """
+    return {ORIGIN_FIELD: f"{PROCESS_ORIGIN}:{next(_origin_seq)}"}
+
+
+def stamp_update(update: dict | list) -> dict | list:
+    """为更新语句附加本进程的来源标记，支持普通更新和聚合管道更新"""
+    if isinstance(update, list):
+        return [*update, {"$set": origin_stamp()}]
+    return {**update, "$set": {**update.get("$set", {}), **origin_stamp()}}
+
+
+@dataclass
+class _Invalidation:
+    callbacks: list[Callable[[Any], None]] = field(default_factory=list)
+    ignore_fields: set[str] | None = None
+
+
+# 文档类 -> 缓存失效回调，由 CacheInvalidationService 在数据库中的文档发生变更时调用
+_invalidations: dict[type["Document"], _Invalidation] = {}
+
+
+def register_invalidation(
+    document: type["Document"], callback: Callable[[Any], None], ignore_fields: set[str] | None = None
+) -> None:
+    """注册缓存失效回调
+
+    回调的参数为发生变更的文档 _id，为 None 时表示无法确定变更的文档，需要清空整个缓存；
+    带有本进程来源标记的更新不会触发回调，只修改了 ignore_fields 中字段的更新也不会触发回调，
+    多个缓存注册同一文档时只忽略它们都忽略的字段
+    """
+    invalidation = _invalidations.setdefault(document, _Invalidation())
+    invalidation.callbacks.append(callback)
+    if ignore_fields is None:
+        invalidation.ignore_fields = set()
+    elif invalidation.ignore_fields is None:
+        invalidation.ignore_fields = set(ignore_fields)
+    else:
+        invalidation.ignore_fields &= ignore_fields
+
+
+def watched_documents() -> dict[type["Document"], set[str]]:
+    """返回需要监听的文档类及其可忽略的字段"""
+    return {document: inv.ignore_fields or set() for document, inv in _invalidations.items()}
+
+
+def invalidate(document: type["Document"], doc_id: Any = None) -> None:  # noqa: ANN401
+    if (invalidation := _invalidations.get(document)) is None:
+        return
+    for callback in invalidation.callbacks:
+        try:
+            callback(doc_id)
+        except Exception:
+            logger.exception(f"[Core.cache] {document.__name__} 缓存失效回调执行失败")
@@ -49,18 +49,81 @@ class TencentCloud:
     text_biztype: str = ""
     image_biztype: str = ""
 
+@dataclass
+class MongoPoolConfig:
+    max_pool_size: int = 100
+    """连接池最大连接数"""
+    min_pool_size: int = 0
+    """连接池最小连接数"""
+    wait_queue_timeout_ms: int = 0
+    """等待空闲连接的超时时间（毫秒），0 为不限制"""
+    compressors: str = ""
+    """网络压缩算法，如 "zstd,snappy,zlib"，zstd 和 snappy 需要安装对应的依赖"""
+    metrics_interval: int = 600
+    """定时打印数据库操作统计的间隔（秒），0 为不打印"""
+
+
+@dataclass
+class LogRetentionConfig:
+    """各类日志的保留天数，0 为永久保留"""
+
+    chat: int = 0
+    coin: int = 0
+    sign: int = 0
+    ban: int = 0
+    ad_display: int = 0
+
+
+@dataclass
+class ArchiveConfig:
+    enabled: bool = False
+    """是否定时归档旧的聊天和游戏币日志"""
+    older_than_days: int = 180
+    """归档多少天之前的日志"""
+    path: str = "data/archive"
+    """归档文件的保存目录"""
+    upload_s3: bool = False
+    """是否将归档文件上传到 S3"""
+
+
+@dataclass
+class RenderConfig:
+    page_pool_size: int = 4
+    """预热的渲染页面数量，同时也是最大并发渲染数"""
+    page_max_uses: int = 200
+    """渲染页面使用多少次后关闭并重新创建"""
+    memory_cache_mb: int = 256
+    """渲染结果内存缓存的大小（MB），其中也保存了正文与页脚拼接后未压缩的位图"""
+    disk_cache_mb: int = 512
+    """渲染结果磁盘缓存的大小（MB）"""
+    cache_ttl: int = 86400
+    """渲染结果缓存的有效期（秒）"""
+    footer_refresh_interval: int = 600
+    """页脚一言和广告图片的刷新间隔（秒）"""
+
+
 @config("main")
 class BasicConfig:
     log_chat: bool = True
     """是否将聊天信息打印在日志中"""
     debug: bool = False
     """是否启用调试模式"""
+    query_profiler: bool = False
+    """是否启用查询分析器，用于开发和压测，退出时在 data/query_profile.md 生成报告"""
     protocol: Protocol = field(default_factory=Protocol)
     """协议配置"""
     owner: int = 0
     """机器人所有者 AID"""
     database_uri: str = "mongodb://localhost:27017"
     """MongoDB数据库uri"""
+    database_pool: MongoPoolConfig = field(default_factory=MongoPoolConfig)
+    """MongoDB连接池配置"""
+    log_retention: LogRetentionConfig = field(default_factory=LogRetentionConfig)
+    """日志保留天数配置"""
+    archive: ArchiveConfig = field(default_factory=ArchiveConfig)
+    """日志归档配置"""
+    render: RenderConfig = field(default_factory=RenderConfig)
+    """图片渲染配置"""
     s3file: S3FileConfig = field(default_factory=S3FileConfig)
     """S3文件存储配置"""
     tencent_cloud: TencentCloud = field(default_factory=TencentCloud)
@@ -14,7 +14,7 @@ from graia.scheduler.timers import crontabify
 from loguru import logger
 
 from utils.config import BasicConfig
-from utils.db import AUser
+from utils.db import AUser, AUserCore
 
 channel = Channel.current()
 
@@ -27,7 +27,7 @@ BOT_SHUTDOWN = False
 async def work_scheduled(ctx: Context) -> None:
     Rest.set_sleep(0)
     config = kayaku.create(BasicConfig)
-    auser = await AUser.find_one(AUser.cid == config.owner)
+    auser = await AUser.find_one(AUser.cid == config.owner).project(AUserCore)
     if auser:
         sel = Selector().land("qq").friend(auser.cid)
         await ctx.account.get_context(sel).scene.send_message("早安！")
@@ -38,7 +38,7 @@ async def work_scheduled(ctx: Context) -> None:
 async def rest_scheduled(ctx: Context) -> None:
     Rest.set_sleep(1)
     config = kayaku.create(BasicConfig)
-    auser = await AUser.find_one(AUser.cid == config.owner)
+    auser = await AUser.find_one(AUser.cid == config.owner).project(AUserCore)
     if auser:
         sel = Selector().land("qq").friend(auser.cid)
         await ctx.account.get_context(sel).scene.send_message("晚安！")
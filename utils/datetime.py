@@ -3,6 +3,8 @@ from zoneinfo import ZoneInfo
 
 CHINA_TZ = ZoneInfo("Asia/Shanghai")
 MONTHS_IN_YEAR = 12
+# 每日状态（签到、活跃、转账额度）在每天 4 点重置
+DAY_START_HOUR = 4
 
 
 def get_all_days_of_month(year: int, month: int) -> list[datetime]:
@@ -14,3 +16,8 @@ def get_all_days_of_month(year: int, month: int) -> list[datetime]:
     )
 
     return [start_date + timedelta(days=x) for x in range((end_date - start_date).days)]
+
+
+def current_day() -> int:
+    """以每日 4 点为分界的日序号"""
+    return (datetime.now(CHINA_TZ) - timedelta(hours=DAY_START_HOUR)).date().toordinal()
@@ -1,4 +1,21 @@
-from .ad import Advertisement
+from .ad import Advertisement, ad_display_buffer, ad_view_counter
+from .backfill import MIGRATIONS, DayEpochBackfill
+from .buffer import CounterBuffer, LogBuffer
 from .group import GroupData
-from .log import AdDisplayLog, BanLog, ChatLog, CoinLog, ImageContentReviewLog, SignLog, TextContentReviewLog
-from .user import AUser
+from .log import (
+    AdDisplayLog,
+    BanLog,
+    ChatElement,
+    ChatLog,
+    ChatText,
+    CoinLog,
+    ImageContentReviewLog,
+    SignLog,
+    TextContentReviewLog,
+)
+from .migration import Migration, MigrationRunner, MigrationState
+from .monitor import MongoMetrics
+from .sequence import Sequence, SequenceAllocator
+from .stats import BalanceBucket, EconomyRollup, EconomyStats, SourceStats, StatsWatermark
+from .transfer import DAILY_TRANSFER_LIMIT, TransferResult, TransferStatus, transfer_coin
+from .user import AUser, AUserCore, coin_log_buffer, user_counter
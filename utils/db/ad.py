@@ -5,8 +5,12 @@ from pydantic import Field
 from pymongo import IndexModel
 
 from models.ad import AdvertisementCategory
+from utils.cache import invalidate, stamp_update
 from utils.datetime import CHINA_TZ
 
+from .buffer import CounterBuffer, LogBuffer
+from .log import AdDisplayLog
+
 
 class Advertisement(Document):
     ad_id: str
@@ -20,15 +24,25 @@ class Advertisement(Document):
     target_audience: list[str] = []
     is_active: bool = True
     bid_price: int = 0
+    views: int = 0
 
     class Settings:
         name = "core_ad"
         indexes = [IndexModel("ad_id", unique=True), IndexModel("bid_price")]
 
     async def activate(self) -> None:
-        self.is_active = True
-        await self.save()  # type: ignore
+        await self._set_active(active=True)
 
     async def deactivate(self) -> None:
-        self.is_active = False
-        await self.save()  # type: ignore
+        await self._set_active(active=False)
+
+    async def _set_active(self, *, active: bool) -> None:
+        # views 由写回缓冲在数据库中累加，整份保存会用实例中过期的值覆盖
+        await self.get_motor_collection().update_one({"_id": self.id}, stamp_update({"$set": {"is_active": active}}))
+        self.is_active = active
+        # 本进程的写入不会经 change stream 触发缓存失效，直接通知广告索引重新加载
+        invalidate(Advertisement, self.id)
+
+
+ad_view_counter = CounterBuffer(Advertisement, "ad_id")
+ad_display_buffer = LogBuffer(AdDisplayLog)
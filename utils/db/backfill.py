@@ -0,0 +1,27 @@
+from utils.datetime import current_day
+
+from .migration import Migration
+from .user import AUser
+
+
+class DayEpochBackfill(Migration):
+    """为旧用户补上 day_epoch，旧数据的每日状态由之前的每日任务重置过，属于今天"""
+
+    name = "auser_day_epoch"
+    version = 1
+    document = AUser
+    # 迁移开始时的日序号，迁移跨过每日 4 点时所有文档仍补上同一个日序号
+    epoch: int = 0
+
+    def prepare(self) -> None:
+        self.epoch = current_day()
+
+    def query(self) -> dict:
+        return {"day_epoch": {"$in": [None, 0]}}
+
+    def update(self, doc: dict) -> dict:
+        return {"$set": {"day_epoch": self.epoch}}
+
+
+# 按顺序执行的迁移，新的迁移追加到末尾
+MIGRATIONS: list[Migration] = [DayEpochBackfill()]
@@ -0,0 +1,146 @@
+import asyncio
+from collections import defaultdict
+from collections.abc import Callable
+from typing import Any
+
+from beanie import Document
+from loguru import logger
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+
+class CounterBuffer:
+    """文档计数字段的写回缓冲
+
+    高频的计数更新（如发言次数）先在内存中累计为增量，由 WriteBehindService
+    定时或在累计到一定事件数后合并为一次 bulk_write 写入数据库；
+    文档的其他修改只能使用针对字段的更新，整份保存会把内存中已累计的值再写一次，与增量重复
+    """
+
+    def __init__(
+        self,
+        document: type[Document],
+        key_field: str,
+        flush_threshold: int = 1000,
+        stamp: Callable[[], dict[str, Any]] | None = None,
+    ) -> None:
+        self.document = document
+        self.key_field = key_field
+        self.flush_threshold = flush_threshold
+        # 每次写入时附加的字段，如 utils.cache.origin_stamp 返回的来源标记
+        self.stamp = stamp
+        self.flushed = 0
+        self._inc: defaultdict[Any, dict[str, int]] = defaultdict(dict)
+        self._set: defaultdict[Any, dict[str, Any]] = defaultdict(dict)
+        # (key, 条件) -> 只在文档满足条件时写入的字段
+        self._cond_set: defaultdict[tuple[Any, tuple], dict[str, Any]] = defaultdict(dict)
+        self._events = 0
+        self._full = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._inc.keys() | self._set.keys() | {key for key, _ in self._cond_set})
+
+    def _touch(self) -> None:
+        self._events += 1
+        if self._events >= self.flush_threshold:
+            self._full.set()
+
+    def inc(self, key: Any, field: str, num: int = 1) -> None:  # noqa: ANN401
+        fields = self._inc[key]
+        fields[field] = fields.get(field, 0) + num
+        self._touch()
+
+    def assign(self, key: Any, field: str, value: Any, *, where: dict[str, Any] | None = None) -> None:  # noqa: ANN401
+        """设置字段的值，指定 where 时只在写入时文档仍满足这些条件才生效"""
+        if where:
+            self._cond_set[key, tuple(sorted(where.items()))][field] = value
+        else:
+            self._set[key][field] = value
+        self._touch()
+
+    async def wait_full(self) -> None:
+        await self._full.wait()
+
+    def _stamped(self, update: dict[str, Any]) -> dict[str, Any]:
+        if self.stamp is None:
+            return update
+        return {**update, "$set": {**update.get("$set", {}), **self.stamp()}}
+
+    async def flush(self) -> int:
+        """写入所有累计的增量，返回写入的文档数"""
+        pending_inc, self._inc = self._inc, defaultdict(dict)
+        pending_set, self._set = self._set, defaultdict(dict)
+        pending_cond_set, self._cond_set = self._cond_set, defaultdict(dict)
+        self._events = 0
+        self._full.clear()
+
+        requests = []
+        for key in pending_inc.keys() | pending_set.keys():
+            update = {}
+            if key in pending_inc:
+                update["$inc"] = pending_inc[key]
+            if key in pending_set:
+                update["$set"] = pending_set[key]
+            requests.append(UpdateOne({self.key_field: key}, self._stamped(update)))
+        for (key, where), fields in pending_cond_set.items():
+            requests.append(UpdateOne({self.key_field: key, **dict(where)}, self._stamped({"$set": fields})))
+        if not requests:
+            return 0
+
+        try:
+            await self.document.get_motor_collection().bulk_write(requests, ordered=False)
+        except Exception:
+            # 写入失败时将增量合并回缓冲区，等待下一次写入
+            for key, fields in pending_inc.items():
+                for field, num in fields.items():
+                    self._inc[key][field] = self._inc[key].get(field, 0) + num
+            for key, fields in pending_set.items():
+                self._set[key] = {**fields, **self._set[key]}
+            for cond, fields in pending_cond_set.items():
+                self._cond_set[cond] = {**fields, **self._cond_set[cond]}
+            logger.exception(f"[Core.db] {self.document.__name__} 计数写入失败，{len(requests)} 条增量已保留")
+            raise
+        self.flushed += len(requests)
+        return len(requests)
+
+
+class LogBuffer:
+    """日志文档的写回缓冲，由 WriteBehindService 合并为 insert_many 写入"""
+
+    def __init__(self, document: type[Document], flush_threshold: int = 500) -> None:
+        self.document = document
+        self.flush_threshold = flush_threshold
+        self.flushed = 0
+        self._docs: list[Document] = []
+        self._full = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def append(self, doc: Document) -> None:
+        self._docs.append(doc)
+        if len(self._docs) >= self.flush_threshold:
+            self._full.set()
+
+    async def wait_full(self) -> None:
+        await self._full.wait()
+
+    async def flush(self) -> int:
+        docs, self._docs = self._docs, []
+        self._full.clear()
+        if not docs:
+            return 0
+        try:
+            await self.document.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # 部分写入成功时只保留写入失败的文档，重复键说明该文档在之前的重试中已经写入
+            failed = {error["index"] for error in e.details.get("writeErrors", []) if error.get("code") != 11000}
+            self._docs[:0] = [doc for i, doc in enumerate(docs) if i in failed]
+            logger.warning(f"[Core.db] {self.document.__name__} 有 {len(failed)} 条日志写入失败，已保留")
+            raise
+        except Exception:
+            self._docs[:0] = docs
+            logger.exception(f"[Core.db] {self.document.__name__} 日志写入失败，{len(docs)} 条日志已保留")
+            raise
+        self.flushed += len(docs)
+        return len(docs)
@@ -1,6 +1,15 @@
+from typing import TYPE_CHECKING
+
 from beanie import Document
 from pymongo import IndexModel
 
+from utils.cache import stamp_update
+
+from .log import BanLog
+
+if TYPE_CHECKING:
+    from models.saya import FuncItem
+
 
 class GroupData(Document):
     group_id: str
@@ -10,3 +19,60 @@ class GroupData(Document):
     class Settings:
         name = "core_group"
         indexes = [IndexModel("group_id", unique=True)]
+
+    async def _update_if(self, condition: dict, update: dict) -> bool:
+        """对数据库中的群文档做条件更新，文档已不满足条件时返回 False，此时调用方不应修改实例"""
+        result = await self.get_motor_collection().update_one({"_id": self.id, **condition}, stamp_update(update))
+        return result.modified_count > 0
+
+    async def ban(self, reason: str, source: str) -> bool:
+        if self.banned:
+            return False
+        if not await self._update_if({"banned": False}, {"$set": {"banned": True}}):
+            return False
+        self.banned = True
+        await BanLog.insert(
+            BanLog(
+                target_id=self.group_id,
+                target_type="group",
+                action="ban",
+                ban_reason=reason,
+                ban_source=source,
+            )
+        )
+        return True
+
+    async def unban(self, reason: str, source: str) -> bool:
+        if not self.banned:
+            return False
+        if not await self._update_if({"banned": True}, {"$set": {"banned": False}}):
+            return False
+        self.banned = False
+        await BanLog.insert(
+            BanLog(
+                target_id=self.group_id,
+                target_type="group",
+                action="unban",
+                ban_reason=reason,
+                ban_source=source,
+            )
+        )
+        return True
+
+    async def disable_function(self, function: str, meta: "FuncItem") -> bool:
+        if function in self.disable_functions or not meta.can_be_disabled:
+            return False
+        if not await self._update_if(
+            {"disable_functions": {"$ne": function}}, {"$push": {"disable_functions": function}}
+        ):
+            return False
+        self.disable_functions.append(function)
+        return True
+
+    async def enable_function(self, function: str, meta: "FuncItem") -> bool:
+        if function not in self.disable_functions or meta.maintain:
+            return False
+        if not await self._update_if({"disable_functions": function}, {"$pull": {"disable_functions": function}}):
+            return False
+        self.disable_functions.remove(function)
+        return True
@@ -1,26 +1,167 @@
 from datetime import datetime
-from typing import Literal
+from typing import ClassVar, Literal
 
 from avilla.core import MessageChain
-from beanie import Document
-from pydantic import Field
-from pymongo import IndexModel
+from avilla.core.elements import Face, Notice, NoticeAll, Picture, Text
+from beanie import Document, PydanticObjectId
+from pydantic import BaseModel, Field, PrivateAttr
+from pymongo import ASCENDING, DESCENDING, IndexModel, WriteConcern
 
 from models.tcm.ims import IMSResponseModel
 from models.tcm.tms import TMSResponseModel
 from utils.datetime import CHINA_TZ
+from utils.hash import text_blake2b
+
+# 不超过该长度的文本直接内联保存，更长的文本保存到 ChatText 中按哈希引用
+INLINE_TEXT_LIMIT = 32
+
+
+class ChatText(Document):
+    """聊天记录中的长文本，按内容哈希去重，复读和刷屏的文本只会保存一次
+
+    last_seen 为最近一次被聊天记录引用的时间，与 ChatLog 使用相同的保留天数，
+    不再被引用的文本随之过期；归档聊天记录时会内联其引用的文本
+    """
+
+    id: str  # type: ignore[assignment]
+    text: str
+    last_seen: datetime = Field(default_factory=datetime.now, tzinfo=CHINA_TZ)
+
+    retention_key: ClassVar[str] = "chat"
+    ttl_field: ClassVar[str] = "last_seen"
+    write_concern: ClassVar[WriteConcern] = WriteConcern(w=1)
+
+    class Settings:
+        name = "core_log_chat_text"
+
+    @classmethod
+    async def prune(cls, before: datetime) -> int:
+        """删除 before 之后没有再被引用的文本，返回删除数"""
+        result = await cls.get_motor_collection().delete_many({"last_seen": {"$lt": before}})
+        return result.deleted_count
+
+    @classmethod
+    async def inline(cls, docs: list[dict]) -> None:
+        """将聊天记录文档中的长文本哈希替换为文本内容，用于归档后脱离 ChatText 读取"""
+        hashes = {element["v"] for doc in docs for element in doc.get("chain", []) if element.get("t") == "h"}
+        if not hashes:
+            return
+        cursor = cls.get_motor_collection().find({"_id": {"$in": list(hashes)}})
+        texts = {text["_id"]: text["text"] async for text in cursor}
+        for doc in docs:
+            for element in doc.get("chain", []):
+                if element.get("t") == "h" and element["v"] in texts:
+                    element["t"], element["v"] = "t", texts[element["v"]]
+
+
+class ChatElement(BaseModel):
+    """紧凑的消息元素
+
+    t 为元素类型：t 内联文本，h 长文本哈希，p 图片（S3 对象名），a 提及，aa 提及全体，f 表情，u 其他；
+    v 为对应的值
+    """
+
+    t: str
+    v: str | None = None
 
 
 class ChatLog(Document):
     qid: str
     group_id: str | None
     message_id: str
-    message_display: str
+    chain: list[ChatElement] = []
+    message_display: str | None = None  # 旧版本记录的消息文本
     time: datetime = Field(default_factory=datetime.now, tzinfo=CHINA_TZ)
 
+    # 需要写入 ChatText 的长文本，由 ChatLogWriter 写入，不保存在日志中
+    _texts: dict[str, str] = PrivateAttr(default_factory=dict)
+    # 是否已交给 ChatLogWriter 写入数据库，之后的修改需要另行更新
+    _flushed: bool = PrivateAttr(default=False)
+
+    # 按 LogRetentionConfig 中对应的保留天数建立 TTL 索引
+    retention_key: ClassVar[str] = "chat"
+    ttl_field: ClassVar[str] = "time"
+    # 聊天记录允许在主节点故障时丢失少量数据，换取更低的写入延迟
+    write_concern: ClassVar[WriteConcern] = WriteConcern(w=1)
+
     class Settings:
         name = "core_log_chat"
-        indexes = [IndexModel("qid")]
+        indexes = [
+            IndexModel([("qid", ASCENDING), ("time", DESCENDING)]),
+            IndexModel([("group_id", ASCENDING), ("time", DESCENDING)]),
+        ]
+
+    @classmethod
+    def from_chain(cls, message_chain: MessageChain, *, qid: str, group_id: str | None, message_id: str) -> "ChatLog":
+        """将消息链编码为紧凑的元素列表，图片的 S3 对象名在上传后由 ChatLogWriter.attach_picture 补上"""
+        chain: list[ChatElement] = []
+        texts: dict[str, str] = {}
+        for element in message_chain:
+            if isinstance(element, Text):
+                if len(element.text) <= INLINE_TEXT_LIMIT:
+                    chain.append(ChatElement(t="t", v=element.text))
+                else:
+                    text_hash = text_blake2b(element.text)
+                    texts[text_hash] = element.text
+                    chain.append(ChatElement(t="h", v=text_hash))
+            elif isinstance(element, Picture):
+                chain.append(ChatElement(t="p"))
+            elif isinstance(element, Notice):
+                chain.append(ChatElement(t="a", v=element.target.last_value))
+            elif isinstance(element, NoticeAll):
+                chain.append(ChatElement(t="aa"))
+            elif isinstance(element, Face):
+                chain.append(ChatElement(t="f", v=str(element.id)))
+            else:
+                chain.append(ChatElement(t="u", v=type(element).__name__))
+        # 预先生成 _id，写入后仍可以按 _id 补上图片
+        log = cls(id=PydanticObjectId(), qid=qid, group_id=group_id, message_id=message_id, chain=chain)
+        log.set_pending_texts(texts)
+        return log
+
+    @property
+    def pending_texts(self) -> dict[str, str]:
+        return self._texts
+
+    def set_pending_texts(self, texts: dict[str, str]) -> None:
+        """设置写入日志前需要合并写入 ChatText 的长文本"""
+        self._texts = texts
+
+    @property
+    def flushed(self) -> bool:
+        return self._flushed
+
+    def mark_flushed(self) -> None:
+        self._flushed = True
+
+    @property
+    def picture_indexes(self) -> list[int]:
+        return [i for i, element in enumerate(self.chain) if element.t == "p"]
+
+    async def display(self) -> str:
+        """还原消息的显示文本"""
+        if not self.chain:
+            return self.message_display or ""
+        hashes = [element.v for element in self.chain if element.t == "h"]
+        texts = {text.id: text.text async for text in ChatText.find({"_id": {"$in": hashes}})} if hashes else {}
+        parts = []
+        for element in self.chain:
+            match element.t:
+                case "t":
+                    parts.append(element.v or "")
+                case "h":
+                    parts.append(texts.get(element.v, "[文本已丢失]"))  # type: ignore[arg-type]
+                case "p":
+                    parts.append(f"[图片:{element.v}]" if element.v else "[图片]")
+                case "a":
+                    parts.append(f"[@{element.v}]")
+                case "aa":
+                    parts.append("[@全体成员]")
+                case "f":
+                    parts.append(f"[表情:{element.v}]")
+                case _:
+                    parts.append(f"[{element.v}]")
+        return "".join(parts)
 
 
 class SignLog(Document):
@@ -28,9 +169,12 @@ class SignLog(Document):
     group_id: str
     sign_time: datetime = Field(default_factory=datetime.now, tzinfo=CHINA_TZ)
 
+    retention_key: ClassVar[str] = "sign"
+    ttl_field: ClassVar[str] = "sign_time"
+
     class Settings:
         name = "core_log_sign"
-        indexes = [IndexModel("qid")]
+        indexes = [IndexModel([("qid", ASCENDING), ("sign_time", DESCENDING)])]
 
 
 class CoinLog(Document):
@@ -41,9 +185,16 @@ class CoinLog(Document):
     detail: str = ""
     time: datetime = Field(default_factory=datetime.now, tzinfo=CHINA_TZ)
 
+    retention_key: ClassVar[str] = "coin"
+    ttl_field: ClassVar[str] = "time"
+    write_concern: ClassVar[WriteConcern] = WriteConcern(w="majority")
+
     class Settings:
         name = "core_log_coin"
-        indexes = [IndexModel("qid")]
+        indexes = [
+            IndexModel([("qid", ASCENDING), ("time", DESCENDING)]),
+            IndexModel([("group_id", ASCENDING), ("time", DESCENDING)]),
+        ]
 
 
 class BanLog(Document):
@@ -54,8 +205,12 @@ class BanLog(Document):
     ban_reason: str | None = None
     ban_source: str | None = None
 
+    retention_key: ClassVar[str] = "ban"
+    ttl_field: ClassVar[str] = "ban_time"
+
     class Settings:
         name = "core_log_ban"
+        indexes = [IndexModel([("target_id", ASCENDING), ("ban_time", DESCENDING)])]
 
 
 class AdDisplayLog(Document):
@@ -65,9 +220,13 @@ class AdDisplayLog(Document):
     client_id: str
     target_audience: list[str]
 
+    retention_key: ClassVar[str] = "ad_display"
+    ttl_field: ClassVar[str] = "display_time"
+    write_concern: ClassVar[WriteConcern] = WriteConcern(w=1)
+
     class Settings:
         name = "core_log_ad_display"
-        indexes = [IndexModel("ad_id")]
+        indexes = [IndexModel([("ad_id", ASCENDING), ("display_time", DESCENDING)])]
 
 
 class ImageContentReviewLog(Document):
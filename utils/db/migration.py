@@ -0,0 +1,118 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, ClassVar, Literal
+
+from beanie import Document
+from loguru import logger
+from pydantic import Field
+from pymongo import UpdateOne
+
+from utils.datetime import CHINA_TZ
+
+
+class MigrationState(Document):
+    """数据迁移的进度，last_id 为已处理的最后一个文档的 _id，用于中断后继续"""
+
+    id: str  # type: ignore[assignment]
+    version: int
+    status: Literal["running", "done"] = "running"
+    last_id: Any = None
+    processed: int = 0
+    total: int = 0
+    started_at: datetime = Field(default_factory=datetime.now, tzinfo=CHINA_TZ)
+    finished_at: datetime | None = None
+
+    class Settings:
+        name = "core_migration"
+
+
+class Migration(ABC):
+    """后台数据迁移
+
+    子类声明 name、version、document 和需要迁移的文档条件 query，并实现 update 返回单个文档的更新；
+    迁移按 _id 顺序分批执行，每批之后保存进度并暂停 throttle 秒，提高 version 会从头重新执行
+    """
+
+    name: ClassVar[str]
+    version: ClassVar[int] = 1
+    document: ClassVar[type[Document]]
+    batch_size: ClassVar[int] = 500
+    throttle: ClassVar[float] = 0.1
+
+    @abstractmethod
+    def query(self) -> dict:
+        """需要迁移的文档条件，迁移完成的文档不应再满足该条件"""
+
+    @abstractmethod
+    def update(self, doc: dict) -> dict | list | None:
+        """返回该文档的更新语句，返回 None 则跳过"""
+
+    def prepare(self) -> None:  # noqa: B027
+        """每次开始（或继续）迁移之前调用，用于确定整个迁移过程中保持不变的值"""
+
+    async def migrate_batch(self, docs: list[dict]) -> None:
+        requests = [
+            UpdateOne({"_id": doc["_id"], **self.query()}, update)
+            for doc in docs
+            if (update := self.update(doc)) is not None
+        ]
+        if requests:
+            await self.document.get_motor_collection().bulk_write(requests, ordered=False)
+
+
+class MigrationRunner:
+    def __init__(self, migrations: list[Migration], progress_interval: float = 30) -> None:
+        self.migrations = migrations
+        self.progress_interval = progress_interval
+
+    async def _state(self, migration: Migration) -> MigrationState:
+        state = await MigrationState.get(migration.name)
+        if state is None or state.version < migration.version:
+            state = MigrationState(id=migration.name, version=migration.version)
+            await state.save()  # type: ignore
+        return state
+
+    async def run_one(self, migration: Migration) -> None:
+        state = await self._state(migration)
+        if state.status == "done":
+            return
+        collection = migration.document.get_motor_collection()
+        # 启动时的检查：没有需要迁移的文档时直接标记完成
+        if await collection.find_one(migration.query(), {"_id": True}) is None:
+            state.status = "done"
+            state.finished_at = datetime.now(CHINA_TZ)
+            await state.save()  # type: ignore
+            logger.info(f"[Core.migration] {migration.name} 无需迁移")
+            return
+
+        migration.prepare()
+        state.total = state.processed + await collection.count_documents(migration.query())
+        logger.info(f"[Core.migration] 开始迁移 {migration.name}，预计 {state.total} 个文档")
+        last_report = time.monotonic()
+        while True:
+            query = migration.query()
+            if state.last_id is not None:
+                query = {"$and": [query, {"_id": {"$gt": state.last_id}}]}
+            docs = await collection.find(query).sort("_id", 1).limit(migration.batch_size).to_list(None)
+            if not docs:
+                break
+            await migration.migrate_batch(docs)
+            state.last_id = docs[-1]["_id"]
+            state.processed += len(docs)
+            await state.save()  # type: ignore
+            if time.monotonic() - last_report >= self.progress_interval:
+                last_report = time.monotonic()
+                percent = state.processed / state.total if state.total else 1
+                logger.info(f"[Core.migration] {migration.name} 进度 {state.processed}/{state.total} {percent:.1%}")
+            await asyncio.sleep(migration.throttle)
+
+        state.status = "done"
+        state.finished_at = datetime.now(CHINA_TZ)
+        await state.save()  # type: ignore
+        logger.success(f"[Core.migration] {migration.name} 迁移完成，共处理 {state.processed} 个文档")
+
+    async def run(self) -> None:
+        for migration in self.migrations:
+            await self.run_one(migration)
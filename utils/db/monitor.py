@@ -0,0 +1,148 @@
+import threading
+from bisect import bisect_left
+from dataclasses import dataclass, field
+
+from pymongo import monitoring
+
+# 延迟直方图的桶上界（毫秒），最后一个桶收集超过 1 秒的操作
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+@dataclass
+class LatencyStats:
+    count: int = 0
+    failed: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    buckets: list[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))
+
+    def record(self, ms: float, *, failed: bool = False) -> None:
+        self.count += 1
+        self.failed += failed
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.buckets[bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+
+    def percentile(self, p: float) -> float:
+        """按直方图估算分位数，返回所在桶的上界"""
+        if not self.count:
+            return 0.0
+        target = self.count * p
+        seen = 0
+        for i, num in enumerate(self.buckets):
+            seen += num
+            if seen >= target:
+                return float(LATENCY_BUCKETS_MS[i]) if i < len(LATENCY_BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def to_dict(self) -> dict[str, float | int | dict[str, int]]:
+        labels = [f"<={b}ms" for b in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        return {
+            "count": self.count,
+            "failed": self.failed,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max_ms, 3),
+            "histogram": dict(zip(labels, self.buckets, strict=True)),
+        }
+
+
+class MongoMetrics(monitoring.CommandListener, monitoring.ConnectionPoolListener):
+    """MongoDB 命令和连接池的监听器
+
+    按 (集合, 命令) 统计操作次数和延迟直方图，并统计从连接池取出连接的等待时间；
+    监听器在驱动的工作线程中被调用，所有统计都在锁内更新
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pending: dict[tuple[tuple[str, int | None], int], tuple[str, str]] = {}
+        self.commands: dict[tuple[str, str], LatencyStats] = {}
+        self.checkout = LatencyStats()
+        self.checkout_failed = 0
+        self.connections = 0
+
+    # CommandListener
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        # getMore 的命令值是游标 ID，集合名在 collection 字段中
+        target = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+        collection = target if isinstance(target, str) else event.database_name
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (collection, event.command_name)
+
+    def _finish(self, event: monitoring.CommandSucceededEvent | monitoring.CommandFailedEvent, *, failed: bool) -> None:
+        with self._lock:
+            key = self._pending.pop((event.connection_id, event.request_id), None)
+            if key is None:
+                return
+            if key not in self.commands:
+                self.commands[key] = LatencyStats()
+            self.commands[key].record(event.duration_micros / 1000, failed=failed)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finish(event, failed=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finish(event, failed=True)
+
+    # ConnectionPoolListener
+
+    def connection_checked_out(self, event: monitoring.ConnectionCheckedOutEvent) -> None:
+        with self._lock:
+            self.checkout.record((event.duration or 0) * 1000)
+
+    def connection_check_out_failed(self, event: monitoring.ConnectionCheckOutFailedEvent) -> None:
+        with self._lock:
+            self.checkout_failed += 1
+            self.checkout.record((event.duration or 0) * 1000, failed=True)
+
+    def connection_created(self, event: monitoring.ConnectionCreatedEvent) -> None:
+        with self._lock:
+            self.connections += 1
+
+    def connection_closed(self, event: monitoring.ConnectionClosedEvent) -> None:
+        with self._lock:
+            self.connections -= 1
+
+    def connection_check_out_started(self, event: monitoring.ConnectionCheckOutStartedEvent) -> None: ...
+
+    def connection_checked_in(self, event: monitoring.ConnectionCheckedInEvent) -> None: ...
+
+    def connection_ready(self, event: monitoring.ConnectionReadyEvent) -> None: ...
+
+    def pool_created(self, event: monitoring.PoolCreatedEvent) -> None: ...
+
+    def pool_ready(self, event: monitoring.PoolReadyEvent) -> None: ...
+
+    def pool_cleared(self, event: monitoring.PoolClearedEvent) -> None: ...
+
+    def pool_closed(self, event: monitoring.PoolClosedEvent) -> None: ...
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "commands": {f"{coll}.{cmd}": stats.to_dict() for (coll, cmd), stats in self.commands.items()},
+                "pool": {
+                    "connections": self.connections,
+                    "checkout": self.checkout.to_dict(),
+                    "checkout_failed": self.checkout_failed,
+                },
+            }
+
+    def summary(self, top: int = 10) -> str:
+        """按总耗时排列的操作摘要，用于定时日志"""
+        with self._lock:
+            ranked = sorted(self.commands.items(), key=lambda item: item[1].total_ms, reverse=True)[:top]
+            lines = [
+                f"连接数 {self.connections}，取连接 {self.checkout.count} 次，"
+                f"平均等待 {self.checkout.to_dict()['avg_ms']}ms，最长 {self.checkout.max_ms:.1f}ms，"
+                f"失败 {self.checkout_failed} 次"
+            ]
+            lines.extend(
+                f"{coll}.{cmd}: {stats.count} 次，平均 {stats.total_ms / stats.count:.2f}ms，"
+                f"p99 {stats.percentile(0.99):.0f}ms，失败 {stats.failed} 次"
+                for (coll, cmd), stats in ranked
+            )
+        return "\n".join(lines)
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import sys
+import threading
+from collections import defaultdict
+from collections.abc import Callable
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+import motor.frameworks.asyncio as motor_asyncio
+from motor.core import AgnosticDatabase
+from pymongo import monitoring
+
+ROOT = Path(__file__).parents[2]
+# 会话和集群相关的字段不属于查询本身，explain 时需要去掉
+SESSION_FIELDS = {"lsid", "$clusterTime", "$db", "txnNumber", "autocommit", "startTransaction", "$readPreference"}
+EXPLAINABLE = {"find", "aggregate", "count", "distinct"}
+
+# 发起查询的代码位置和所属的事件（asyncio 任务），由 motor 在线程池中执行查询时带入
+_origin: ContextVar[tuple[str, int] | None] = ContextVar("abot_query_origin", default=None)
+
+
+def _find_origin() -> str:
+    """在调用栈中找到发起查询的项目代码，优先选择 func 下的插件代码"""
+    frame = sys._getframe(2)  # noqa: SLF001
+    fallback = None
+    while frame is not None:
+        path = Path(frame.f_code.co_filename)
+        if path.is_relative_to(ROOT) and ".venv" not in path.parts:
+            rel = path.relative_to(ROOT).as_posix()
+            location = f"{rel}:{frame.f_lineno} {frame.f_code.co_name}"
+            if rel.startswith("func/"):
+                return location
+            if fallback is None and not rel.startswith("utils/db/profiler"):
+                fallback = location
+        frame = frame.f_back
+    return fallback or "<unknown>"
+
+
+def _shape(value: Any) -> Any:  # noqa: ANN401
+    """将查询条件中的值替换为占位符，得到查询的形状"""
+    if isinstance(value, dict):
+        return {k: _shape(v) for k, v in value.items()}
+    if isinstance(value, list | tuple):
+        return [_shape(v) for v in value[:1]]
+    return "?"
+
+
+def _query_of(name: str, command: dict) -> Any:  # noqa: ANN401
+    match name:
+        case "find" | "count" | "distinct":
+            return command.get("filter", command.get("query", {}))
+        case "aggregate":
+            pipeline = command.get("pipeline", [])
+            return pipeline[0].get("$match", {}) if pipeline else {}
+        case "findAndModify":
+            return command.get("query", {})
+        case "update":
+            return command.get("updates", [{}])[0].get("q", {})
+        case "delete":
+            return command.get("deletes", [{}])[0].get("q", {})
+    return {}
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    max_repeat: int = 0
+    slow_command: dict | None = None
+    explain: dict | None = None
+
+
+@dataclass
+class _Pending:
+    key: tuple[str, str, str, str]
+    task_id: int
+    command: dict = field(repr=False)
+
+
+class QueryProfiler(monitoring.CommandListener):
+    """开发模式下的查询分析器
+
+    通过替换 motor 的线程池调度函数记录每个查询的发起位置和所属事件，统计耗时和
+    同一事件内相同形状查询的重复次数（N+1），并对慢查询执行 explain 以发现全表扫描
+    """
+
+    def __init__(self, slow_ms: float = 50, repeat_threshold: int = 5) -> None:
+        self.slow_ms = slow_ms
+        self.repeat_threshold = repeat_threshold
+        self.stats: defaultdict[tuple[str, str, str, str], QueryStats] = defaultdict(QueryStats)
+        self._repeats: defaultdict[int, defaultdict[tuple[str, str, str, str], int]] = defaultdict(
+            lambda: defaultdict(int)
+        )
+        self._pending: dict[tuple[Any, int], _Pending] = {}
+        self._lock = threading.Lock()
+        self._original_run_on_executor: Callable | None = None
+
+    def install(self) -> None:
+        """必须在创建数据库客户端之前调用"""
+        if self._original_run_on_executor is not None:
+            return
+        monitoring.register(self)
+        original = self._original_run_on_executor = motor_asyncio.run_on_executor
+
+        def run_on_executor(
+            loop: asyncio.AbstractEventLoop, fn: Callable, *args: Any, **kwargs: Any  # noqa: ANN401
+        ) -> Any:  # noqa: ANN401
+            task = asyncio.current_task(loop)
+            origin = (_find_origin(), id(task) if task else 0)
+
+            def run(*a: Any, **kw: Any) -> Any:  # noqa: ANN401
+                # motor 会在复制的上下文中执行 fn，这里的设置不会影响调用方
+                _origin.set(origin)
+                return fn(*a, **kw)
+
+            return original(loop, run, *args, **kwargs)
+
+        motor_asyncio.run_on_executor = run_on_executor
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        origin = _origin.get()
+        if origin is None or event.command_name in {"getMore", "endSessions", "explain"}:
+            return
+        location, task_id = origin
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else event.database_name
+        shape = json.dumps(_shape(_query_of(event.command_name, event.command)), sort_keys=True, default=str)
+        key = (location, collection, event.command_name, shape)
+        with self._lock:
+            repeats = self._repeats[task_id]
+            repeats[key] += 1
+            stats = self.stats[key]
+            stats.max_repeat = max(stats.max_repeat, repeats[key])
+            self._pending[(event.connection_id, event.request_id)] = _Pending(key, task_id, event.command)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finish(event)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finish(event)
+
+    def _finish(self, event: monitoring.CommandSucceededEvent | monitoring.CommandFailedEvent) -> None:
+        ms = event.duration_micros / 1000
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+            if pending is None:
+                return
+            stats = self.stats[pending.key]
+            stats.count += 1
+            stats.total_ms += ms
+            stats.max_ms = max(stats.max_ms, ms)
+            if ms >= self.slow_ms and stats.slow_command is None and pending.key[2] in EXPLAINABLE:
+                stats.slow_command = {k: v for k, v in pending.command.items() if k not in SESSION_FIELDS}
+            # 只保留最近的事件的重复计数，防止长时间运行时无限增长
+            if len(self._repeats) > 10000:
+                self._repeats.pop(next(iter(self._repeats)))
+
+    async def explain_slow(self, database: AgnosticDatabase) -> None:
+        for stats in list(self.stats.values()):
+            if stats.slow_command is None or stats.explain is not None:
+                continue
+            try:
+                stats.explain = await database.command({"explain": stats.slow_command, "verbosity": "executionStats"})
+            except Exception as e:
+                stats.explain = {"error": str(e)}
+
+    @staticmethod
+    def _explain_summary(explain: dict) -> tuple[bool, int | None, int | None]:
+        """返回 (是否全表扫描, 扫描文档数, 返回文档数)"""
+        collscan = "COLLSCAN" in json.dumps(explain, default=str)
+        examined = returned = None
+
+        def walk(value: Any) -> None:  # noqa: ANN401
+            nonlocal examined, returned
+            if isinstance(value, dict):
+                if examined is None and "totalDocsExamined" in value:
+                    examined = value["totalDocsExamined"]
+                    returned = value.get("nReturned")
+                for v in value.values():
+                    walk(v)
+            elif isinstance(value, list):
+                for v in value:
+                    walk(v)
+
+        walk(explain)
+        return collscan, examined, returned
+
+    def report(self) -> str:
+        with self._lock:
+            items = list(self.stats.items())
+        lines = ["# 查询分析报告", "", "## 总耗时最高的查询", ""]
+        lines.append("| 位置 | 集合.命令 | 形状 | 次数 | 平均ms | 最大ms | 单事件最多重复 |")
+        lines.append("| --- | --- | --- | --: | --: | --: | --: |")
+        for (location, collection, command, shape), stats in sorted(
+            items, key=lambda item: item[1].total_ms, reverse=True
+        )[:30]:
+            avg = stats.total_ms / stats.count if stats.count else 0
+            lines.append(
+                f"| {location} | {collection}.{command} | `{shape}` | {stats.count} | {avg:.2f} | "
+                f"{stats.max_ms:.2f} | {stats.max_repeat} |"
+            )
+
+        lines.extend(["", f"## 疑似 N+1 查询（单个事件内重复 {self.repeat_threshold} 次以上）", ""])
+        suspects = [item for item in items if item[1].max_repeat >= self.repeat_threshold]
+        for (location, collection, command, shape), stats in sorted(
+            suspects, key=lambda item: item[1].max_repeat, reverse=True
+        ):
+            lines.append(f"- {location}：{collection}.{command} `{shape}` 最多重复 {stats.max_repeat} 次")
+        if not suspects:
+            lines.append("- 无")
+
+        lines.extend(["", f"## 慢查询（超过 {self.slow_ms}ms）的执行计划", ""])
+        explained = [item for item in items if item[1].explain is not None]
+        for (location, collection, command, shape), stats in explained:
+            if "error" in stats.explain:  # type: ignore[operator]
+                lines.append(f"- {location}：{collection}.{command} `{shape}` explain 失败：{stats.explain['error']}")  # type: ignore[index]
+                continue
+            collscan, examined, returned = self._explain_summary(stats.explain)  # type: ignore[arg-type]
+            flag = "**全表扫描，可能缺少索引**" if collscan else "使用索引"
+            lines.append(
+                f"- {location}：{collection}.{command} `{shape}` {flag}，扫描 {examined} 个文档，返回 {returned} 个"
+            )
+        if not explained:
+            lines.append("- 无")
+        return "\n".join(lines) + "\n"
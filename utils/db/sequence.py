@@ -0,0 +1,66 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from typing import ClassVar
+
+from beanie import Document
+from pymongo import ReturnDocument, WriteConcern
+
+
+class Sequence(Document):
+    id: str  # type: ignore[assignment]
+    seq: int = 0
+
+    write_concern: ClassVar[WriteConcern] = WriteConcern(w="majority")
+
+    class Settings:
+        name = "core_sequence"
+
+    @classmethod
+    async def seed(cls, name: str, value: int) -> None:
+        """保证计数器不小于 value，用于从已有数据的最大编号继续分配"""
+        await cls.get_motor_collection().update_one({"_id": name}, {"$max": {"seq": value}}, upsert=True)
+
+    @classmethod
+    async def take(cls, name: str, count: int = 1) -> int:
+        """原子地申请 count 个编号，返回申请到的最后一个编号"""
+        result = await cls.get_motor_collection().find_one_and_update(
+            {"_id": name},
+            {"$inc": {"seq": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return int(result["seq"])
+
+
+class SequenceAllocator:
+    """自增编号分配器
+
+    每次从数据库原子地申请一段编号缓存在内存中，用完后再申请下一段，
+    block_size 大于 1 时进程重启会丢弃未用完的编号（编号不连续但不会重复）
+    """
+
+    def __init__(
+        self,
+        name: str,
+        seed: Callable[[], Awaitable[int]] | None = None,
+        block_size: int = 1,
+    ) -> None:
+        self.name = name
+        self.block_size = block_size
+        self._seed = seed
+        self._seeded = seed is None
+        self._next = 1
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    async def next(self) -> int:
+        async with self._lock:
+            if not self._seeded:
+                await Sequence.seed(self.name, await self._seed())  # type: ignore[misc]
+                self._seeded = True
+            if self._next > self._end:
+                self._end = await Sequence.take(self.name, self.block_size)
+                self._next = self._end - self.block_size + 1
+            value = self._next
+            self._next += 1
+            return value
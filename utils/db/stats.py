@@ -0,0 +1,216 @@
+from datetime import datetime, timedelta
+from typing import Any
+
+from beanie import Document
+from bson import ObjectId
+from pydantic import BaseModel, Field
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from utils.datetime import CHINA_TZ
+
+from .log import CoinLog
+from .user import AUser
+
+# 余额分布的区间下界，最后一个区间为 [100000, +∞)
+BALANCE_BOUNDARIES = [0, 1, 100, 500, 1000, 2000, 5000, 10000, 50000, 100000]
+
+
+class SourceStats(BaseModel):
+    minted: int = 0
+    burned: int = 0
+    records: int = 0
+
+
+class BalanceBucket(BaseModel):
+    min: int | None
+    max: int | None
+    users: int
+    coins: int
+
+
+class EconomyStats(Document):
+    """每日的经济统计，流水部分由 EconomyRollup 增量累加，余额部分为当天最后一次快照
+
+    last_id 为最后一次累加到该文档的流水批次的上界，用于保证同一批流水不会被重复累加
+    """
+
+    id: str  # type: ignore[assignment]  # 日期，例如 2024-01-01
+    minted: int = 0
+    burned: int = 0
+    records: int = 0
+    sources: dict[str, SourceStats] = {}
+    last_id: Any = None
+    supply: int | None = None
+    users: int | None = None
+    distribution: list[BalanceBucket] = []
+    snapshot_at: datetime | None = None
+
+    class Settings:
+        name = "core_stats_economy"
+
+    @property
+    def net(self) -> int:
+        return self.minted - self.burned
+
+
+class StatsWatermark(Document):
+    """统计任务已处理到的位置"""
+
+    id: str  # type: ignore[assignment]
+    last_id: Any = None
+    updated_at: datetime = Field(default_factory=datetime.now, tzinfo=CHINA_TZ)
+
+    class Settings:
+        name = "core_stats_watermark"
+
+
+def _source_key(source: str) -> str:
+    # 字段名中不能出现 . 也不能以 $ 开头
+    return source.replace(".", "_").lstrip("$") or "未知"
+
+
+class EconomyRollup:
+    """将新增的 CoinLog 按 _id 水位增量汇总到 EconomyStats，并记录余额分布快照
+
+    流水按 _id 顺序分批处理，只处理 lag 之前写入的流水，避免缓冲中稍晚写入的流水被水位跳过
+    """
+
+    name = "economy"
+
+    def __init__(self, batch_size: int = 10000, lag: timedelta = timedelta(minutes=2)) -> None:
+        self.batch_size = batch_size
+        self.lag = lag
+
+    async def _fold(self, last_id: ObjectId | None, upper: ObjectId) -> None:
+        id_range: dict[str, ObjectId] = {"$lte": upper}
+        if last_id is not None:
+            id_range["$gt"] = last_id
+        groups = (
+            await CoinLog.get_motor_collection()
+            .aggregate(
+                [
+                    {"$match": {"_id": id_range}},
+                    {
+                        "$group": {
+                            # CoinLog.time 为不带时区的北京时间
+                            "_id": {
+                                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$time"}},
+                                "source": "$source",
+                            },
+                            "minted": {"$sum": {"$max": ["$coin", 0]}},
+                            "burned": {"$sum": {"$max": [{"$subtract": [0, "$coin"]}, 0]}},
+                            "records": {"$sum": 1},
+                        }
+                    },
+                ]
+            )
+            .to_list(None)
+        )
+
+        days: dict[str, dict[str, int]] = {}
+        for group in groups:
+            inc = days.setdefault(group["_id"]["day"], {})
+            source = _source_key(group["_id"]["source"])
+            for field in ("minted", "burned", "records"):
+                inc[field] = inc.get(field, 0) + group[field]
+                inc[f"sources.{source}.{field}"] = inc.get(f"sources.{source}.{field}", 0) + group[field]
+        if not days:
+            return
+        requests = [
+            UpdateOne(
+                {"_id": day, "last_id": {"$not": {"$gte": upper}}},
+                {"$inc": inc, "$set": {"last_id": upper}},
+                upsert=True,
+            )
+            for day, inc in days.items()
+        ]
+        try:
+            await EconomyStats.get_motor_collection().bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            # 重复键说明该批次已累加过（上次在更新水位前中断），直接跳过
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+    async def rollup(self) -> int:
+        """累加新增的流水，返回处理的流水数"""
+        watermark = await StatsWatermark.get(self.name) or StatsWatermark(id=self.name)
+        cutoff = ObjectId.from_datetime(datetime.now(CHINA_TZ) - self.lag)
+        collection = CoinLog.get_motor_collection()
+        total = 0
+        while True:
+            id_range: dict[str, ObjectId] = {"$lt": cutoff}
+            if watermark.last_id is not None:
+                id_range["$gt"] = watermark.last_id
+            ids = (
+                await collection.find({"_id": id_range}, {"_id": True})
+                .sort("_id", 1)
+                .limit(self.batch_size)
+                .to_list(None)
+            )
+            if not ids:
+                return total
+            upper = ids[-1]["_id"]
+            await self._fold(watermark.last_id, upper)
+            watermark.last_id = upper
+            watermark.updated_at = datetime.now(CHINA_TZ)
+            await watermark.save()  # type: ignore
+            total += len(ids)
+
+    async def snapshot(self) -> EconomyStats:
+        """统计当前的游戏币总量和余额分布，写入今天的统计文档"""
+        result = (
+            await AUser.get_motor_collection()
+            .aggregate(
+                [
+                    {"$project": {"_id": 0, "coin": True}},
+                    {
+                        "$facet": {
+                            "supply": [{"$group": {"_id": None, "coins": {"$sum": "$coin"}, "users": {"$sum": 1}}}],
+                            "distribution": [
+                                {
+                                    "$bucket": {
+                                        "groupBy": "$coin",
+                                        "boundaries": [*BALANCE_BOUNDARIES, float("inf")],
+                                        "default": "other",
+                                        "output": {"users": {"$sum": 1}, "coins": {"$sum": "$coin"}},
+                                    }
+                                }
+                            ],
+                        }
+                    },
+                ]
+            )
+            .to_list(None)
+        )
+        facet = result[0]
+        upper_bounds = dict(zip(BALANCE_BOUNDARIES, [*BALANCE_BOUNDARIES[1:], None], strict=True))
+        distribution = [
+            BalanceBucket(
+                # 负数余额等不在区间内的用户归入 other
+                min=None if bucket["_id"] == "other" else int(bucket["_id"]),
+                max=None if bucket["_id"] == "other" else upper_bounds[int(bucket["_id"])],
+                users=bucket["users"],
+                coins=bucket["coins"],
+            )
+            for bucket in facet["distribution"]
+        ]
+        supply = facet["supply"][0] if facet["supply"] else {"coins": 0, "users": 0}
+        now = datetime.now(CHINA_TZ)
+        today = f"{now:%Y-%m-%d}"
+        await EconomyStats.get_motor_collection().update_one(
+            {"_id": today},
+            {
+                "$set": {
+                    "supply": supply["coins"],
+                    "users": supply["users"],
+                    "distribution": [bucket.model_dump() for bucket in distribution],
+                    "snapshot_at": now,
+                }
+            },
+            upsert=True,
+        )
+        return await EconomyStats.get(today)  # type: ignore[return-value]
+
+    async def recent(self, days: int = 7) -> list[EconomyStats]:
+        return await EconomyStats.find_all().sort("-_id").limit(days).to_list()
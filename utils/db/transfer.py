@@ -0,0 +1,185 @@
+from dataclasses import dataclass
+from enum import Enum, auto
+
+from motor.core import AgnosticDatabase
+from motor.motor_asyncio import AsyncIOMotorClientSession
+from pymongo import ReturnDocument
+
+from utils.cache import stamp_update
+
+from .log import CoinLog
+from .user import AUser, coin_log_buffer
+
+# 每日转账限额
+DAILY_TRANSFER_LIMIT = 200
+
+
+class TransferStatus(Enum):
+    SUCCESS = auto()
+    INSUFFICIENT_COIN = auto()  # 余额不足
+    EXCEED_LIMIT = auto()  # 超出每日限额
+    RECIPIENT_MISSING = auto()  # 收款用户不存在
+    SENDER_MISSING = auto()  # 付款用户不存在
+
+
+@dataclass
+class TransferResult:
+    status: TransferStatus
+    sender_coin: int
+    recipient_coin: int | None
+    today_transferred: int
+
+    @property
+    def success(self) -> bool:
+        return self.status == TransferStatus.SUCCESS
+
+
+class _RecipientMissingError(Exception):
+    """事务中入账时收款用户已不存在，用于中止事务"""
+
+
+@dataclass
+class TransactionSupport:
+    """数据库是否支持事务，由 MongoDBService 在 preparing 阶段按部署拓扑检测
+
+    单机部署的 MongoDB 不支持事务，检测之前按不支持处理
+    """
+
+    supported: bool = False
+
+    async def detect(self, database: AgnosticDatabase) -> bool:
+        """副本集成员和 mongos 支持事务，单机部署时转账使用带补偿的条件更新"""
+        hello = await database.command("hello")
+        self.supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+        return self.supported
+
+
+transaction_support = TransactionSupport()
+
+
+def _build_logs(sender: AUser, recipient: AUser, num: int, group_id: str | int | None) -> list[CoinLog]:
+    return [
+        CoinLog(
+            qid=sender.cid,
+            group_id=str(group_id),
+            coin=-num,
+            source="转账",
+            detail=f"转账给 AID：{recipient.aid}",
+        ),
+        CoinLog(
+            qid=recipient.cid,
+            group_id=str(group_id),
+            coin=num,
+            source="转账",
+            detail=f"来自 AID：{sender.aid}",
+        ),
+    ]
+
+
+async def _debit(sender: AUser, num: int, session: AsyncIOMotorClientSession | None = None) -> dict | None:
+    return await AUser.get_motor_collection().find_one_and_update(
+        {"_id": sender.id, "coin": {"$gte": num}, "today_transferred": {"$lte": DAILY_TRANSFER_LIMIT - num}},
+        stamp_update({"$inc": {"coin": -num, "today_transferred": num}}),
+        projection={"coin": True, "today_transferred": True},
+        return_document=ReturnDocument.AFTER,
+        session=session,
+    )
+
+
+async def _credit(recipient: AUser, num: int, session: AsyncIOMotorClientSession | None = None) -> dict | None:
+    return await AUser.get_motor_collection().find_one_and_update(
+        {"_id": recipient.id},
+        stamp_update({"$inc": {"coin": num}}),
+        projection={"coin": True},
+        return_document=ReturnDocument.AFTER,
+        session=session,
+    )
+
+
+async def _rejected(sender: AUser, num: int, session: AsyncIOMotorClientSession | None = None) -> TransferResult:
+    current = await AUser.get_motor_collection().find_one(
+        {"_id": sender.id}, {"coin": True, "today_transferred": True}, session=session
+    )
+    if current is None:
+        # 扣款的条件更新对已不存在的付款用户同样不会命中
+        return TransferResult(TransferStatus.SENDER_MISSING, sender.coin, None, sender.today_transferred)
+    sender.coin = current["coin"]
+    sender.today_transferred = current["today_transferred"]
+    status = TransferStatus.INSUFFICIENT_COIN if sender.coin < num else TransferStatus.EXCEED_LIMIT
+    return TransferResult(status, sender.coin, None, sender.today_transferred)
+
+
+async def _refund(sender: AUser, num: int) -> None:
+    await AUser.get_motor_collection().update_one(
+        {"_id": sender.id}, stamp_update({"$inc": {"coin": num, "today_transferred": -num}})
+    )
+
+
+async def _recipient_missing(sender: AUser) -> TransferResult:
+    current = await AUser.get_motor_collection().find_one({"_id": sender.id}, {"coin": True, "today_transferred": True})
+    if current is not None:
+        sender.coin = current["coin"]
+        sender.today_transferred = current["today_transferred"]
+    return TransferResult(TransferStatus.RECIPIENT_MISSING, sender.coin, None, sender.today_transferred)
+
+
+async def _transfer_in_transaction(
+    sender: AUser, recipient: AUser, num: int, group_id: str | int | None
+) -> TransferResult:
+    client = AUser.get_motor_collection().database.client
+
+    async def callback(session: AsyncIOMotorClientSession) -> TransferResult:
+        debit = await _debit(sender, num, session)
+        if debit is None:
+            return await _rejected(sender, num, session)
+        credit = await _credit(recipient, num, session)
+        if credit is None:
+            # 抛出异常使事务回滚扣款
+            raise _RecipientMissingError
+        await CoinLog.insert_many(_build_logs(sender, recipient, num, group_id), session=session)
+        return TransferResult(TransferStatus.SUCCESS, debit["coin"], credit["coin"], debit["today_transferred"])
+
+    async with await client.start_session() as session:
+        try:
+            return await session.with_transaction(callback)
+        except _RecipientMissingError:
+            return await _recipient_missing(sender)
+
+
+async def _transfer_with_compensation(
+    sender: AUser, recipient: AUser, num: int, group_id: str | int | None
+) -> TransferResult:
+    debit = await _debit(sender, num)
+    if debit is None:
+        return await _rejected(sender, num)
+    try:
+        credit = await _credit(recipient, num)
+    except Exception:
+        # 入账失败时退回扣款
+        await _refund(sender, num)
+        raise
+    if credit is None:
+        # 收款用户已不存在，同样退回扣款
+        await _refund(sender, num)
+        return await _recipient_missing(sender)
+    for log in _build_logs(sender, recipient, num, group_id):
+        coin_log_buffer.append(log)
+    return TransferResult(TransferStatus.SUCCESS, debit["coin"], credit["coin"], debit["today_transferred"])
+
+
+async def transfer_coin(sender: AUser, recipient: AUser, num: int, group_id: str | int | None = None) -> TransferResult:
+    """在两个用户间转账
+
+    扣款（含余额和每日限额检查）、入账和两条流水在同一个事务中完成，
+    数据库不支持事务时退化为带补偿的条件更新
+    """
+    if transaction_support.supported:
+        result = await _transfer_in_transaction(sender, recipient, num, group_id)
+    else:
+        result = await _transfer_with_compensation(sender, recipient, num, group_id)
+
+    if result.success:
+        sender.coin = result.sender_coin
+        sender.today_transferred = result.today_transferred
+        recipient.coin = result.recipient_coin  # type: ignore[assignment]
+    return result
@@ -1,17 +1,33 @@
 from datetime import datetime
-from typing import Any
+from typing import Any, ClassVar
 
-from beanie import Document
-from pydantic import Field
-from pymongo import IndexModel
+from beanie import Document, Replace, Save, before_event
+from pydantic import BaseModel, Field
+from pymongo import IndexModel, ReturnDocument, WriteConcern
 
-from utils.datetime import CHINA_TZ
+from utils.cache import origin_stamp, stamp_update
+from utils.datetime import CHINA_TZ, current_day
 
+from .buffer import CounterBuffer, LogBuffer
 from .log import BanLog, CoinLog, SignLog
 
 DefaultData = Any
 
 
+class AUserCore(BaseModel):
+    """AUser 的精简视图，用于只读取身份和余额的场景
+
+    用法：await AUser.find_one(AUser.cid == cid).project(AUserCore)，
+    不包含 func_data 和每日状态，因此不会触发每日状态的懒重置
+    """
+
+    aid: int
+    cid: str
+    coin: int = 10
+    nickname: str | None = None
+    banned: bool = False
+
+
 class AUser(Document):
     aid: int
     cid: str
@@ -23,15 +39,36 @@ class AUser(Document):
     total_sign: int = 0
     totle_talk: int = 0
     continue_sign: int = 0
+    # is_sign、is_chat、today_transferred 所属的日序号，见 utils.datetime.current_day
+    day_epoch: int = 0
+    # 每日重置前最后一次签到、发言所在的日序号，供每日统计使用
+    last_sign_epoch: int = 0
+    last_chat_epoch: int = 0
     exp: int = 0
     banned: bool = False
     join_time: datetime = Field(default_factory=datetime.now, tzinfo=CHINA_TZ)
+    # 经 find_without_data 读取的实例只包含通过 get_data/set_data 等访问过的路径
     func_data: dict = {}
 
+    # 游戏币等数据需要在副本集多数节点确认后才算写入成功
+    write_concern: ClassVar[WriteConcern] = WriteConcern(w="majority")
+
     class Settings:
         name = "core_user"
         indexes = [IndexModel("aid", unique=True), IndexModel("cid", unique=True)]
 
+    @classmethod
+    async def find_without_data(cls, query: dict) -> "AUser | None":
+        """读取用户但不读取 func_data，用于消息处理等高频的场景，func_data 按路径通过 get_data 读取"""
+        doc = await cls.get_motor_collection().find_one(query, {"func_data": False})
+        return None if doc is None else cls.model_validate(doc)
+
+    @before_event(Save, Replace)
+    def _forbid_full_save(self) -> None:
+        # 实例中的 func_data 不完整，计数字段也由写回缓冲累加，整份保存会覆盖这些数据
+        msg = "AUser 只能通过针对字段的更新方法修改，不能整份保存"
+        raise RuntimeError(msg)
+
     @property
     def level(self) -> int:
         """计算用户等级"""
@@ -87,21 +124,82 @@ class AUser(Document):
 
         return f"[{progress_bar}{remaining_bar}] {progress_ratio * 100:.1f}%"
 
+    async def rollover(self) -> None:
+        """跨过每日 4 点的分界后，在首次访问时重置当日状态
+
+        是否需要重置由数据库中的日序号决定，缓存中过期的实例只会读回其他访问已完成的重置；
+        尚未记录日序号的旧数据不在这里处理，由数据迁移补上日序号
+        """
+        today = current_day()
+        if self.day_epoch >= today:
+            return
+        # 只有上一天签到过才保留连续签到天数
+        signed_yesterday = {"$and": ["$is_sign", {"$eq": ["$day_epoch", today - 1]}]}
+        update = [
+            {
+                # 同一阶段中的表达式读取的都是更新前的值，重置前先记下当日是否签到、发言
+                "$set": {
+                    "continue_sign": {"$cond": [signed_yesterday, "$continue_sign", 0]},
+                    "last_sign_epoch": {"$cond": ["$is_sign", "$day_epoch", {"$ifNull": ["$last_sign_epoch", 0]}]},
+                    "last_chat_epoch": {"$cond": ["$is_chat", "$day_epoch", {"$ifNull": ["$last_chat_epoch", 0]}]},
+                    "is_sign": False,
+                    "is_chat": False,
+                    "today_transferred": 0,
+                    "day_epoch": today,
+                }
+            }
+        ]
+        projection = dict.fromkeys(["is_sign", "is_chat", "today_transferred", "continue_sign", "day_epoch"], True)
+        collection = self.get_motor_collection()
+        result = await collection.find_one_and_update(
+            {"_id": self.id, "day_epoch": {"$gt": 0, "$lt": today}},
+            stamp_update(update),
+            projection=projection,
+            return_document=ReturnDocument.AFTER,
+        )
+        if result is None:
+            # 已经由并发的访问完成了重置，或者是尚未迁移的旧数据
+            result = await collection.find_one({"_id": self.id}, projection)
+            if result is None:
+                return
+        self.is_sign = result.get("is_sign", False)
+        self.is_chat = result.get("is_chat", False)
+        self.today_transferred = result.get("today_transferred", 0)
+        self.continue_sign = result.get("continue_sign", 0)
+        self.day_epoch = result.get("day_epoch") or 0
+
+    async def _set_flag(self, field: str, *, value: bool) -> bool:
+        """只修改单个布尔字段，数据库中已经是该值时返回 False"""
+        result = await self.get_motor_collection().update_one(
+            {"_id": self.id, field: {"$ne": value}}, stamp_update({"$set": {field: value}})
+        )
+        setattr(self, field, value)
+        return result.modified_count > 0
+
     async def sign(self, group_id: str | int) -> bool:
         if self.is_sign:
             return False
+        result = await self.get_motor_collection().find_one_and_update(
+            {"_id": self.id, "is_sign": False},
+            stamp_update({"$set": {"is_sign": True}, "$inc": {"total_sign": 1, "continue_sign": 1}}),
+            projection={"total_sign": True, "continue_sign": True},
+            return_document=ReturnDocument.AFTER,
+        )
+        if result is None:
+            # 已经由并发的请求完成了签到
+            self.is_sign = True
+            return False
         self.is_sign = True
-        self.total_sign += 1
-        self.continue_sign += 1
-        await self.save()  # type: ignore
+        self.total_sign = result["total_sign"]
+        self.continue_sign = result["continue_sign"]
         await SignLog.insert(SignLog(qid=self.cid, group_id=str(group_id)))
         return True
 
     async def ban(self, reason: str, source: str) -> bool:
         if self.banned:
             return False
-        self.banned = True
-        await self.save()  # type: ignore
+        if not await self._set_flag("banned", value=True):
+            return False
         await BanLog.insert(
             BanLog(
                 target_id=self.cid,
@@ -116,8 +214,8 @@ class AUser(Document):
     async def unban(self, reason: str, source: str) -> bool:
         if not self.banned:
             return False
-        self.banned = False
-        await self.save()  # type: ignore
+        if not await self._set_flag("banned", value=False):
+            return False
         await BanLog.insert(
             BanLog(
                 target_id=self.cid,
@@ -135,10 +233,19 @@ class AUser(Document):
         group_id: str | int | None = None,
         source: str = "未知",
         detail: str = "",
-    ) -> None:
-        self.coin += num
-        await self.save()  # type: ignore
-        await CoinLog.insert(
+    ) -> int:
+        """增加游戏币，返回增加后的余额"""
+        result = await self.get_motor_collection().find_one_and_update(
+            {"_id": self.id},
+            stamp_update({"$inc": {"coin": num}}),
+            projection={"coin": True},
+            return_document=ReturnDocument.AFTER,
+        )
+        if result is None:
+            msg = f"未找到用户: {self.cid}"
+            raise ValueError(msg)
+        self.coin = result["coin"]
+        coin_log_buffer.append(
             CoinLog(
                 qid=self.cid,
                 group_id=str(group_id),
@@ -147,6 +254,7 @@ class AUser(Document):
                 detail=detail,
             )
         )
+        return self.coin
 
     async def reduce_coin(
         self,
@@ -156,59 +264,138 @@ class AUser(Document):
         detail: str = "",
         *,
         force: bool = False,
-    ) -> int | bool:
-        if self.coin < num:
-            if not force:
-                return False
-            now_coin = self.coin
-            self.coin = 0
-            await self.save()  # type: ignore
-            await CoinLog.insert(
-                CoinLog(
-                    qid=self.cid,
-                    group_id=str(group_id),
-                    coin=-now_coin,
-                    source=source,
-                    detail=detail,
-                )
+    ) -> int | None:
+        """扣除游戏币，返回扣除后的余额
+
+        余额不足时，非强制扣除不扣除并返回 None；强制扣除会扣到 0 为止
+        """
+        collection = self.get_motor_collection()
+        if force:
+            # 余额不足时扣到 0 为止，需要扣除前的余额计算实际扣除的数量
+            result = await collection.find_one_and_update(
+                {"_id": self.id},
+                stamp_update([{"$set": {"coin": {"$max": [{"$subtract": ["$coin", num]}, 0]}}}]),
+                projection={"coin": True},
+                return_document=ReturnDocument.BEFORE,
+            )
+            if result is None:
+                msg = f"未找到用户: {self.cid}"
+                raise ValueError(msg)
+            reduced = min(result["coin"], num)
+            self.coin = result["coin"] - reduced
+        else:
+            result = await collection.find_one_and_update(
+                {"_id": self.id, "coin": {"$gte": num}},
+                stamp_update({"$inc": {"coin": -num}}),
+                projection={"coin": True},
+                return_document=ReturnDocument.AFTER,
             )
-            return now_coin
-        self.coin -= num
-        await self.save()
-        await CoinLog.insert(
+            if result is None:
+                return None
+            reduced = num
+            self.coin = result["coin"]
+        coin_log_buffer.append(
             CoinLog(
                 qid=self.cid,
                 group_id=str(group_id),
-                coin=-num,
+                coin=-reduced,
                 source=source,
                 detail=detail,
             )
         )
-        return True
+        return self.coin
 
     async def add_talk(self) -> None:
         self.totle_talk += 1
         self.is_chat = True
-        await self.save()
+        user_counter.inc(self.cid, "totle_talk")
+        # 跨过每日分界后才写入的活跃状态属于前一天，不能标记到新的一天上
+        user_counter.assign(self.cid, "is_chat", True, where={"day_epoch": self.day_epoch})
 
     async def set_nickname(self, nickname: str | None) -> None:
+        await self.get_motor_collection().update_one({"_id": self.id}, stamp_update({"$set": {"nickname": nickname}}))
         self.nickname = nickname
-        await self.save()
 
-    async def get_data(self, key: str, default: DefaultData = None) -> DefaultData:
+    @staticmethod
+    def _data_keys(key: str) -> list[str]:
+        """校验 func_data 的键路径，路径形如 "plugin.field"，每一段都不能为空或包含 $"""
         key_list = key.split(".")
-        data = self.func_data
-        for k in key_list:
-            if data is None:
-                return default
-            data = data.get(k)
+        if not all(key_list) or any(k.startswith("$") for k in key_list):
+            msg = f"无效的数据路径: {key!r}"
+            raise ValueError(msg)
+        return key_list
 
-    async def set_data(self, key: str, value: DefaultData) -> None:
-        key_list = key.split(".")
+    def _mirror_data(self, key_list: list[str], value: DefaultData = None, *, delete: bool = False) -> None:
+        """将 $set / $inc / $unset 对数据库的修改同步到内存中的 func_data，使实例与数据库保持一致"""
         data = self.func_data
         for k in key_list[:-1]:
-            if k not in data:
+            if not isinstance(data.get(k), dict):
+                if delete:
+                    return
                 data[k] = {}
             data = data[k]
-        data[key_list[-1]] = value
-        await self.save()
+        if delete:
+            data.pop(key_list[-1], None)
+        else:
+            data[key_list[-1]] = value
+
+    @staticmethod
+    def _walk_data(data: dict | None, key_list: list[str], default: DefaultData) -> DefaultData:
+        for k in key_list:
+            if not isinstance(data, dict) or k not in data:
+                return default
+            data = data[k]
+        return data
+
+    async def get_data(self, key: str, default: DefaultData = None) -> DefaultData:
+        """从数据库中读取 func_data 的某个路径，只取回该路径下的数据"""
+        key_list = self._data_keys(key)
+        result = await self.get_motor_collection().find_one({"_id": self.id}, {f"func_data.{key}": True})
+        missing = object()
+        value = self._walk_data(result.get("func_data") if result else None, key_list, missing)
+        if value is missing:
+            return default
+        self._mirror_data(key_list, value)
+        return value
+
+    async def set_data(self, key: str, value: DefaultData) -> None:
+        key_list = self._data_keys(key)
+        await self.get_motor_collection().update_one(
+            {"_id": self.id}, stamp_update({"$set": {f"func_data.{key}": value}})
+        )
+        self._mirror_data(key_list, value)
+
+    async def incr_data(self, key: str, num: float = 1) -> float:
+        """原子地增加 func_data 中某个数值，路径不存在时视为 0，返回增加后的值"""
+        key_list = self._data_keys(key)
+        result = await self.get_motor_collection().find_one_and_update(
+            {"_id": self.id},
+            stamp_update({"$inc": {f"func_data.{key}": num}}),
+            projection={f"func_data.{key}": True},
+            return_document=ReturnDocument.AFTER,
+        )
+        if result is None:
+            msg = f"未找到用户: {self.cid}"
+            raise ValueError(msg)
+        value = self._walk_data(result.get("func_data"), key_list, 0)
+        self._mirror_data(key_list, value)
+        return value
+
+    async def delete_data(self, key: str) -> None:
+        key_list = self._data_keys(key)
+        await self.get_motor_collection().update_one(
+            {"_id": self.id}, stamp_update({"$unset": {f"func_data.{key}": ""}})
+        )
+        self._mirror_data(key_list, delete=True)
+
+    @classmethod
+    async def ensure_data_index(cls, key: str, *, unique: bool = False, sparse: bool = True) -> str:
+        """为插件在 func_data 中的某个路径建立索引，便于按插件数据查询用户，返回索引名"""
+        cls._data_keys(key)
+        return await cls.get_motor_collection().create_index(
+            f"func_data.{key}", name=f"func_data.{key}", unique=unique, sparse=sparse
+        )
+
+
+user_counter = CounterBuffer(AUser, "cid", stamp=origin_stamp)
+coin_log_buffer = LogBuffer(CoinLog)
@@ -3,3 +3,7 @@ import hashlib
 
 def data_md5(data: bytes) -> str:
     return hashlib.md5(data).hexdigest()  # noqa: S324
+
+
+def text_blake2b(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
@@ -6,6 +6,8 @@ from avilla.twilight.base import ChainDecorator
 from graia.amnesia.message.chain import MessageChain
 from graia.broadcast.interfaces.dispatcher import DispatcherInterface
 
+from utils.saya.memo import event_memo
+
 if TYPE_CHECKING:
     from graia.amnesia.message import Element
 
@@ -16,7 +18,15 @@ class MentionMe(ChainDecorator):
     async def __call__(self, chain: MessageChain, interface: DispatcherInterface) -> MessageChain:
         if not isinstance(interface.event, MessageReceived):
             return chain
-        ctx = interface.event.context
+        # 同一事件的每个监听器都会传入同一条消息链，处理结果只需计算一次
+        _, result = event_memo(interface.event).get(
+            (MentionMe, id(chain)), lambda: (chain, self._strip(chain, interface.event))
+        )
+        return result
+
+    @staticmethod
+    def _strip(chain: MessageChain, event: MessageReceived) -> MessageChain:
+        ctx = event.context
         first: Element = chain[0]
         if isinstance(first, Notice) and (first.target.last_value in (ctx.self.last_value, "2854214511")):
             chain = MessageChain(chain.content[1:])
@@ -0,0 +1,217 @@
+import asyncio
+import contextlib
+import re
+import time
+from contextlib import AsyncExitStack
+from dataclasses import dataclass, field
+from typing import Any, cast
+
+from graiax.playwright import PlaywrightService
+from graiax.text2img.playwright import HTMLRenderer, ScreenshotOption
+from graiax.text2img.playwright.utils import run_always_await
+from launart import Launart
+from loguru import logger
+from playwright.async_api import Page
+
+from utils.db.monitor import LatencyStats
+
+# 加载基础文档中声明的全部字体，避免首次渲染时再下载字体
+PRELOAD_FONTS = "() => Promise.all([...document.fonts].map((font) => font.load().catch(() => null)))"
+# 等待正文中的图片和字体加载完成
+WAIT_RESOURCES = """async () => {
+    await Promise.all([...document.images].filter((img) => !img.complete).map(
+        (img) => new Promise((resolve) => { img.onload = img.onerror = resolve; })
+    ));
+    await document.fonts.ready;
+}"""
+# 元素相对页面左上角的位置（CSS 像素）及其文字的字号和颜色
+MEASURE_ELEMENT = """(selector) => {
+    const element = document.querySelector(selector);
+    const rect = element.getBoundingClientRect();
+    const style = getComputedStyle(element);
+    return {
+        x: rect.left + window.scrollX,
+        y: rect.top + window.scrollY,
+        width: rect.width,
+        height: rect.height,
+        font_size: parseFloat(style.fontSize),
+        color: style.color,
+    };
+}"""
+# innerHTML 不会执行脚本，也不会等待完整文档中 <head> 引用的外部样式表，这些内容退回 renderer.render
+NEEDS_FULL_PAGE = re.compile(r"<(?:script|html|head|link)\b", re.IGNORECASE)
+
+
+@dataclass
+class _PooledPage:
+    page: Page
+    stack: AsyncExitStack
+    uses: int = 0
+
+    async def close(self) -> None:
+        with contextlib.suppress(Exception):
+            await self.stack.aclose()
+
+
+@dataclass
+class PagePoolStats:
+    renders: int = 0
+    fallbacks: int = 0
+    created: int = 0
+    recycled: int = 0
+    failed: int = 0
+    wait: LatencyStats = field(default_factory=LatencyStats)
+    render: LatencyStats = field(default_factory=LatencyStats)
+
+
+class PagePool:
+    """预热的 Playwright 页面池
+
+    页面创建时安装 renderer 的 page_modifiers（字体路由等）并载入只含样式的基础文档、预加载字体，
+    渲染时只替换 body 的内容并截图，之后清空 body 放回池中；页面使用 max_uses 次后关闭并重新创建
+    """
+
+    def __init__(self, renderer: HTMLRenderer, size: int = 4, max_uses: int = 200) -> None:
+        self.renderer = renderer
+        self.size = size
+        self.max_uses = max_uses
+        self.stats = PagePoolStats()
+        self.base_html = (
+            '<html><head><meta name="viewport" content="width=device-width,initial-scale=1.0">'
+            f"<style>{renderer.style}</style></head><body></body></html>"
+        )
+        self._idle: asyncio.Queue[_PooledPage] = asyncio.Queue()
+        self._slots = asyncio.Semaphore(size)
+        self._launart: Launart | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._launart is not None
+
+    async def _create(self) -> _PooledPage:
+        if self._launart is None:
+            msg = "PagePool 未启动"
+            raise RuntimeError(msg)
+        pw_service = self._launart.get_component(PlaywrightService)
+        stack = AsyncExitStack()
+        try:
+            page = await stack.enter_async_context(pw_service.page(**self.renderer.page_option))
+            for modifier in self.renderer.page_modifiers:
+                await run_always_await(modifier, page)
+            await page.set_content(self.base_html)
+            await page.evaluate(PRELOAD_FONTS)
+        except BaseException:
+            await stack.aclose()
+            raise
+        self.stats.created += 1
+        return _PooledPage(page, stack)
+
+    async def start(self, launart: Launart) -> None:
+        self._launart = launart
+        pages = await asyncio.gather(*(self._create() for _ in range(self.size)), return_exceptions=True)
+        for page in pages:
+            if isinstance(page, BaseException):
+                logger.opt(exception=page).warning("[Util.t2i] 预热页面失败，将在渲染时重新创建")
+            else:
+                self._idle.put_nowait(page)
+        logger.info(f"[Util.t2i] 已预热 {self._idle.qsize()} 个渲染页面")
+
+    async def close(self) -> None:
+        self._launart = None
+        while not self._idle.empty():
+            await self._idle.get_nowait().close()
+
+    async def _acquire(self) -> _PooledPage:
+        start = time.perf_counter()
+        await self._slots.acquire()
+        try:
+            pooled = self._idle.get_nowait() if not self._idle.empty() else await self._create()
+        except BaseException:
+            self._slots.release()
+            raise
+        self.stats.wait.record((time.perf_counter() - start) * 1000)
+        return pooled
+
+    async def _release(self, pooled: _PooledPage, *, broken: bool = False) -> None:
+        try:
+            if broken or pooled.uses >= self.max_uses or not self.running:
+                await pooled.close()
+                if not broken and pooled.uses >= self.max_uses:
+                    self.stats.recycled += 1
+            else:
+                self._idle.put_nowait(pooled)
+        finally:
+            self._slots.release()
+
+    async def render(
+        self,
+        content: str,
+        *,
+        width: int,
+        height: int = 10,
+        extra_screenshot_option: ScreenshotOption | None = None,
+    ) -> bytes:
+        """渲染 HTML 片段；页面池未启动或内容是包含脚本、外部样式表的完整文档时退回 renderer.render"""
+        if not self.running or NEEDS_FULL_PAGE.search(content):
+            self.stats.fallbacks += 1
+            return await self.renderer.render(
+                content,
+                extra_page_option={"viewport": {"width": width, "height": height}},
+                extra_screenshot_option=extra_screenshot_option,
+            )
+        image, _ = await self._render_pooled(content, width, height, extra_screenshot_option)
+        return image
+
+    async def render_measured(
+        self,
+        content: str,
+        selector: str,
+        *,
+        width: int,
+        extra_screenshot_option: ScreenshotOption | None = None,
+    ) -> tuple[bytes, dict[str, Any]]:
+        """渲染 HTML 片段，同时返回 selector 匹配的第一个元素的位置、字号和颜色（见 MEASURE_ELEMENT）
+
+        测量需要使用池中的页面，页面池未启动时抛出 RuntimeError
+        """
+        image, box = await self._render_pooled(content, width, 10, extra_screenshot_option, selector)
+        return image, cast(dict[str, Any], box)
+
+    async def _render_pooled(
+        self,
+        content: str,
+        width: int,
+        height: int,
+        extra_screenshot_option: ScreenshotOption | None,
+        selector: str | None = None,
+    ) -> tuple[bytes, dict[str, Any] | None]:
+        screenshot_option: ScreenshotOption = {**self.renderer.screenshot_option, **(extra_screenshot_option or {})}
+        pooled = await self._acquire()
+        start = time.perf_counter()
+        try:
+            page = pooled.page
+            await page.set_viewport_size({"width": width, "height": height})
+            await page.evaluate("(html) => { document.body.innerHTML = html; }", content)
+            await page.evaluate(WAIT_RESOURCES)
+            box = await page.evaluate(MEASURE_ELEMENT, selector) if selector else None
+            image = await page.screenshot(**screenshot_option)
+            await page.evaluate("() => { document.body.innerHTML = ''; window.scrollTo(0, 0); }")
+        except BaseException:
+            self.stats.failed += 1
+            await self._release(pooled, broken=True)
+            raise
+        pooled.uses += 1
+        self.stats.renders += 1
+        self.stats.render.record((time.perf_counter() - start) * 1000)
+        await self._release(pooled)
+        return image, box
+
+    def summary(self) -> str:
+        wait = self.stats.wait.to_dict()
+        render = self.stats.render.to_dict()
+        return (
+            f"渲染 {self.stats.renders} 次（退回普通渲染 {self.stats.fallbacks} 次，失败 {self.stats.failed} 次），"
+            f"等待页面 avg {wait['avg_ms']}ms p99 {wait['p99_ms']}ms，"
+            f"渲染 avg {render['avg_ms']}ms p99 {render['p99_ms']}ms，"
+            f"创建页面 {self.stats.created} 个，回收 {self.stats.recycled} 个"
+        )
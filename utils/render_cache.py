@@ -0,0 +1,186 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+
+from utils.hash import text_blake2b
+
+
+@dataclass
+class RenderCacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    evicted: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.memory_hits + self.disk_hits + self.misses + self.coalesced
+        return (self.memory_hits + self.disk_hits + self.coalesced) / total if total else 0.0
+
+
+class RenderCache:
+    """渲染结果的两级缓存，以渲染参数的哈希为键
+
+    内存层为按字节数限制的 LRU，磁盘层超出字节上限时按访问时间删除最久未使用的文件，两层的条目都在写入 ttl 秒后过期；
+    同一个键的并发请求只会执行一次渲染，其余请求等待同一个结果
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        *,
+        memory_bytes: int = 64 << 20,
+        disk_bytes: int = 512 << 20,
+        ttl: float = 86400,
+    ) -> None:
+        self.root = root
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.ttl = ttl
+        self.stats = RenderCacheStats()
+        self._memory: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self._memory_size = 0
+        self._disk_size: int | None = None
+        self._inflight: dict[str, asyncio.Task[bytes]] = {}
+
+    @staticmethod
+    def key(*parts: Any) -> str:  # noqa: ANN401
+        return text_blake2b(json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str))
+
+    def _path(self, key: str) -> Path:
+        # 缓存的内容可能是 JPEG 或 PNG 截图，文件名不带图片格式
+        return self.root / key[:2] / f"{key}.bin"
+
+    def _files(self) -> list[Path]:
+        return [path for path in self.root.glob("*/*") if path.suffix != ".tmp"]
+
+    def _memory_get(self, key: str) -> bytes | None:
+        item = self._memory.get(key)
+        if item is None:
+            return None
+        if item[0] < time.monotonic():
+            self._memory_pop(key)
+            return None
+        self._memory.move_to_end(key)
+        return item[1]
+
+    def _memory_pop(self, key: str) -> None:
+        if (item := self._memory.pop(key, None)) is not None:
+            self._memory_size -= len(item[1])
+
+    def _memory_set(self, key: str, data: bytes, expires: float) -> None:
+        if len(data) > self.memory_bytes:
+            return
+        self._memory_pop(key)
+        self._memory[key] = (expires, data)
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes:
+            _, (_, old) = self._memory.popitem(last=False)
+            self._memory_size -= len(old)
+            self.stats.evicted += 1
+
+    def _disk_get(self, key: str) -> tuple[bytes, float] | None:
+        path = self._path(key)
+        try:
+            mtime = path.stat().st_mtime
+            if mtime + self.ttl < time.time():
+                path.unlink(missing_ok=True)
+                return None
+            data = path.read_bytes()
+            # 命中时只更新访问时间，修改时间仍用于判断过期
+            os.utime(path, (time.time(), mtime))
+        except FileNotFoundError:
+            return None
+        return data, mtime
+
+    def _disk_set(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+        if self._disk_size is None:
+            self._disk_size = sum(f.stat().st_size for f in self._files())
+        else:
+            self._disk_size += len(data)
+        if self._disk_size > self.disk_bytes:
+            self.prune(target=int(self.disk_bytes * 0.9))
+
+    def prune(self, target: int | None = None) -> tuple[int, int]:
+        """删除磁盘上过期的文件，并按访问时间删除最久未使用的文件直到总大小不超过 target，返回 (文件数, 删除数)"""
+        target = self.disk_bytes if target is None else target
+        files = []
+        for path in self._files():
+            stat = path.stat()
+            files.append((stat.st_atime, stat.st_mtime, stat.st_size, path))
+        files.sort()
+        now = time.time()
+        total = sum(size for _, _, size, _ in files)
+        removed = 0
+        for _, mtime, size, path in files:
+            if mtime + self.ttl >= now and total <= target:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        self._disk_size = total
+        self.stats.evicted += removed
+        if removed:
+            logger.info(f"[Util.t2i] 已清理 {removed} 个渲染缓存文件")
+        return len(files), removed
+
+    async def _load(self, key: str, render: Callable[[], Awaitable[bytes]], *, persist: bool) -> bytes:
+        if persist and (cached := await asyncio.to_thread(self._disk_get, key)) is not None:
+            data, mtime = cached
+            self.stats.disk_hits += 1
+            self._memory_set(key, data, time.monotonic() + mtime + self.ttl - time.time())
+            return data
+        self.stats.misses += 1
+        data = await render()
+        self._memory_set(key, data, time.monotonic() + self.ttl)
+        if not persist:
+            return data
+        try:
+            await asyncio.to_thread(self._disk_set, key, data)
+        except OSError:
+            logger.exception("[Util.t2i] 写入渲染缓存失败")
+        return data
+
+    def _loaded(self, key: str, task: asyncio.Task[bytes]) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 所有请求都已取消时避免出现 Task exception was never retrieved
+        if not task.cancelled():
+            task.exception()
+
+    async def get_or_render(self, key: str, render: Callable[[], Awaitable[bytes]], *, persist: bool = True) -> bytes:
+        """读取缓存的渲染结果，未命中时执行 render 并写入缓存，persist 为 False 时只缓存在内存中"""
+        if (data := self._memory_get(key)) is not None:
+            self.stats.memory_hits += 1
+            return data
+        if (task := self._inflight.get(key)) is not None:
+            self.stats.coalesced += 1
+        else:
+            task = asyncio.create_task(self._load(key, render, persist=persist))
+            self._inflight[key] = task
+            task.add_done_callback(partial(self._loaded, key))
+        # 渲染在独立的任务中进行，单个请求被取消不会影响等待同一结果的其他请求
+        return await asyncio.shield(task)
+
+    def summary(self) -> str:
+        stats = self.stats
+        return (
+            f"命中率 {stats.hit_rate:.2%}（内存 {stats.memory_hits}，磁盘 {stats.disk_hits}，"
+            f"合并 {stats.coalesced}，未命中 {stats.misses}），"
+            f"内存 {len(self._memory)} 项 {self._memory_size / 1048576:.1f}MB，淘汰 {stats.evicted} 项"
+        )
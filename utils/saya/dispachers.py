@@ -4,12 +4,13 @@ from graia.amnesia.builtins.memcache import Memcache, MemcacheService
 from graia.broadcast.entities.dispatcher import BaseDispatcher
 from graia.broadcast.interfaces.dispatcher import DispatcherInterface
 from launart import Launart
-from loguru import logger
 
 from services import AiohttpClientService, S3File, S3FileService
 from utils.builder import AGroupBuilder, AUserBuilder
 from utils.db import AUser, GroupData
 
+from .memo import event_memo
+
 
 class ABotDispatcher(BaseDispatcher):
     @staticmethod
@@ -19,40 +20,26 @@ class ABotDispatcher(BaseDispatcher):
         if not isinstance(interface.event, MessageReceived):
             return None
         ctx = interface.event.context
+        # 同一事件的所有监听器共享解析结果
+        memo = event_memo(interface.event)
         if interface.annotation == AUser:
             cid = ctx.client.last_value
-            if not await AUser.find_one(AUser.cid == cid):
-                last_userid = await AUser.find_one(sort=[("_id", -1)])
-                user_id = int(last_userid.aid) + 1 if last_userid else 1
-                await AUser(aid=user_id, cid=cid).insert()  # type: ignore[call-arg]
-                logger.info(f"[Core.db] 已初始化用户: [{user_id}] {cid}")
-            user = await AUser.find_one(AUser.cid == cid)
-            if not user:
-                msg = f"未找到用户: {cid}"
-                raise ValueError(msg)
-            return await AUserBuilder.init(user)
+            return await memo.resolve(AUser, lambda: AUserBuilder.fetch(cid))
         if interface.annotation == GroupData:
             if ctx.scene.path_without_land in {"guild.channel", "guild.user"}:
                 group_id = ctx.scene["guild"]
             else:
                 group_id = ctx.scene["group"]
-            if not await GroupData.find_one(GroupData.group_id == group_id):
-                await GroupData(group_id=group_id).insert()  # type: ignore[call-arg]
-                logger.info(f"[Core.db] 已初始化群: {group_id}")
-            group = await GroupData.find_one(GroupData.group_id == group_id)
-            if not group:
-                msg = f"未找到群: {group_id}"
-                raise ValueError(msg)
-            return await AGroupBuilder.init(group)
+            return await memo.resolve(GroupData, lambda: AGroupBuilder.fetch(group_id))
 
         manager = Launart.current()
         if interface.annotation == S3File:
-            return manager.get_component(S3FileService).s3file
+            return memo.get(S3File, lambda: manager.get_component(S3FileService).s3file)
 
         if interface.annotation == ClientSession:
-            return manager.get_component(AiohttpClientService).session
+            return memo.get(ClientSession, lambda: manager.get_component(AiohttpClientService).session)
 
         if interface.annotation == Memcache:
-            return manager.get_component(MemcacheService).cache
+            return memo.get(Memcache, lambda: manager.get_component(MemcacheService).cache)
 
         return None
@@ -0,0 +1,47 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any, TypeVar
+
+from graia.broadcast.entities.event import Dispatchable
+
+T = TypeVar("T")
+
+_MEMO_ATTR = "_abot_memo"
+
+
+class EventMemo:
+    """单个事件内共享的解析结果
+
+    同一个事件会被多个监听器分别处理，每个监听器都会重新走一遍 Dispatcher 和装饰器，
+    将解析结果挂在事件上，可以让它们拿到同一份对象（同一个数据库文档实例），
+    而不是各自查询一遍数据库
+    """
+
+    __slots__ = ("_tasks", "_values")
+
+    def __init__(self) -> None:
+        self._tasks: dict[Hashable, asyncio.Future[Any]] = {}
+        self._values: dict[Hashable, Any] = {}
+
+    async def resolve(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        """获取异步解析的结果，同一事件内并发的多次调用只会执行一次 factory"""
+        task = self._tasks.get(key)
+        if task is None or (task.done() and task.exception() is not None):
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+        # shield 防止单个监听器被取消时连带取消其他监听器正在等待的解析
+        return await asyncio.shield(task)
+
+    def get(self, key: Hashable, factory: Callable[[], T]) -> T:
+        """获取同步计算的结果"""
+        if key not in self._values:
+            self._values[key] = factory()
+        return self._values[key]
+
+
+def event_memo(event: Dispatchable) -> EventMemo:
+    memo = event.__dict__.get(_MEMO_ATTR)
+    if memo is None:
+        memo = EventMemo()
+        event.__dict__[_MEMO_ATTR] = memo
+    return memo
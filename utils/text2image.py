@@ -1,12 +1,15 @@
 import asyncio
-import hashlib
+import functools
+import json
 import random
 import re
 from base64 import b64encode
 from datetime import datetime, timedelta
+from html import escape
 from io import BytesIO
 from pathlib import Path
 
+import kayaku
 from graiax.text2img.playwright import (
     HTMLRenderer,
     MarkdownConverter,
@@ -19,25 +22,35 @@ from jinja2 import Template
 from launart import Launart
 from loguru import logger
 from PIL import Image, ImageDraw, ImageFont
+from PIL.PngImagePlugin import PngInfo
 from playwright.async_api._generated import Request
 from qrcode.image.styledpil import StyledPilImage
 from qrcode.main import QRCode
 
 from models.ad import AdvertisementCategory
-from services import AiohttpClientService, S3FileService
+from services import FooterPrefetchService
 from utils.builder import ADBuilder
+from utils.config import BasicConfig
 from utils.datetime import CHINA_TZ
 
-from .fonts_provider import fill_font
+from .fonts_provider import fill_font, font_path
+from .hash import text_blake2b
+from .page_pool import PagePool
+from .render_cache import RenderCache
 from .strings import get_cut_str
 
 # 广告出现的概率
 DEFAULT_AD_PROBABILITY = 0.7
+# 正文和页脚分别渲染时不再由页脚覆盖正文的下内边距，由渲染时的样式去掉
+NO_BOTTOM_PADDING = "<style>body{padding-bottom:0 !important}</style>"
+# 分别渲染的正文和页脚以无损的 PNG 截图拼接，拼接后只编码一次 JPEG
+PNG_SCREENSHOT = ScreenshotOption(type="png", quality=None)
+# 缓存的页脚不含时间，渲染时测量时间所在元素的位置并写入页脚 PNG 的文本块，每次调用按该位置绘制时间
+FOOTER_TIME_SELECTOR = ".footer-time"
+FOOTER_TIME_INFO = "abot-footer-time"
 
 font_file = "./static/font/sarasa-mono-sc-semibold.ttf"
 font = ImageFont.truetype(font_file, 22)
-cache = Path("cache", "t2i")
-cache.mkdir(exist_ok=True, parents=True)
 
 qrcode = QRCode(image_factory=StyledPilImage)
 qrcode.add_data("https://qun.qq.com/qunpro/robot/share?robot_appid=101985270")
@@ -83,6 +96,18 @@ html_render = HTMLRenderer(
     ],
 )
 
+render_config = kayaku.create(BasicConfig).render
+page_pool = PagePool(html_render, render_config.page_pool_size, render_config.page_max_uses)
+render_cache = RenderCache(
+    Path("cache", "t2i"),
+    memory_bytes=render_config.memory_cache_mb << 20,
+    disk_bytes=render_config.disk_cache_mb << 20,
+    ttl=render_config.cache_ttl,
+)
+# 渲染结果缓存的版本，修改渲染流程时需要提高版本使旧缓存失效，样式的变化会自动体现在缓存键中
+RENDER_VERSION = 2
+style_hash = text_blake2b(html_render.style)
+
 md_converter = MarkdownConverter()
 
 
@@ -93,46 +118,50 @@ def network_requestfailed(request: Request) -> None:
     logger.warning(f"[RequestFailed] [{method} {fail}] << {url}")
 
 
-async def add_footer(
+async def footer_ad(
     category: AdvertisementCategory = AdvertisementCategory.announcement,
     target_audience: list | None = None,
 ) -> str:
+    """随机选择页脚中的广告或一言，内容均来自 FooterPrefetchService 预取的缓存"""
     if target_audience is None:
         target_audience = []
+    prefetcher = Launart.current().get_component(FooterPrefetchService)
     ad = await ADBuilder.get_ad(category, target_audience=target_audience)
     if random.random() > DEFAULT_AD_PROBABILITY and ad:
         ad_type = ad.ad_category.value
         if ad.content_type == 0:
             ad_p = "<p>" + "</p><p>".join(ad.content.splitlines()) + "</p>"
-            ad_html = (
+            return (
                 "<style>.ad-text::before{content: '" + ad_type + "'}</style>"
                 f'<div class="ad-text"><div class="text-area">{ad_p}</div></div>'
             )
-        else:
-            s3file = Launart.current().get_component(S3FileService).s3file
-            ad_image = await s3file.get_object(ad.content)
-            ad_base64 = b64encode(await ad_image.read()).decode()
-            ad_html = (
+        # 图片尚未缓存时本次改为显示一言
+        if data_uri := prefetcher.ad_image(ad.content):
+            return (
                 "<style>.ad-img::before{content: '" + ad_type + "'}</style>"
-                f'<div class="ad-img"><img src="data:image/png;base64,{ad_base64}"/></div>'
+                f'<div class="ad-img"><img src="{data_uri}"/></div>'
             )
-    else:
-        ad_type = "一言"
-        session = Launart.current().get_component(AiohttpClientService).session
-        async with session.get("https://v1.hitokoto.cn/?encode=text") as resp:
-            yiyan = await resp.text()
-        ad_html = (
-            "<style>.ad-text::before{content: '" + ad_type + "'}</style>"
-            f'<div class="ad-text"><div class="text-area">{yiyan}</div></div>'
-        )
+    ad_type = "一言"
+    return (
+        "<style>.ad-text::before{content: '" + ad_type + "'}</style>"
+        f'<div class="ad-text"><div class="text-area">{escape(prefetcher.quote())}</div></div>'
+    )
+
+
+def footer_time() -> str:
+    return datetime.now(CHINA_TZ).strftime("%Y/%m/%d %p %I:%M:%S")
 
+
+def footer_html(ad_html: str, time_text: str = "", *, standalone: bool = False) -> str:
+    """页脚 HTML，standalone 为 True 时页脚位于页面顶部，用于单独渲染页脚"""
+    position = "position:absolute;left:0;top:0;width:100%" if standalone else "position:absolute;left:0;width:100%"
     return f"""
-    <div style="position:absolute;left:0;width:100%">
+    <div style="{position}">
         <footer>
             <section class="left">
                 <div class="footer-text">
                     <p style="font-weight: bold">该图片由 ABot 生成</p>
-                    <p style="font-size: 14px">{datetime.now(CHINA_TZ).strftime("%Y/%m/%d %p %I:%M:%S")}</p>
+                    <p class="footer-time" style="font-size: 14px">{time_text or "&nbsp;"}</p>
                 </div>
                 <section class="ad">{ad_html}</section>
             </section>
@@ -142,6 +171,14 @@ async def add_footer(
     </div>
     """
 
+
+async def add_footer(
+    category: AdvertisementCategory = AdvertisementCategory.announcement,
+    target_audience: list | None = None,
+) -> str:
+    return footer_html(await footer_ad(category, target_audience), footer_time())
+
+
 """
             <section class="right">
                 <div class="qrcode-area">
@@ -155,17 +192,8 @@ async def add_footer(
 """
 
 async def create_image(text: str, cut: int = 64) -> bytes:
-    str_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
-    cache.joinpath(str_hash[:2]).mkdir(exist_ok=True)
-    cache_file = cache.joinpath(f"{str_hash}.jpg")
-    if cache_file.exists():
-        logger.info(f"T2I Cache hit: {str_hash}")
-        image_bytes = cache_file.read_bytes()
-    else:
-        image_bytes = await asyncio.to_thread(_create_pil_image, text, cut)
-        cache_file.write_bytes(image_bytes)
-
-    return image_bytes
+    key = render_cache.key("pil", text, cut)
+    return await render_cache.get_or_render(key, lambda: asyncio.to_thread(_create_pil_image, text, cut))
 
 
 def _create_pil_image(text: str, cut: int) -> bytes:
@@ -188,19 +216,135 @@ def _create_pil_image(text: str, cut: int) -> bytes:
 
 
 def delete_old_cache() -> tuple[int, int]:
-    cache_files = cache.glob("*")
-    i = 0
-    r = 0
-    for cache_file in cache_files:
-        i += 1
-        if (
-            cache_file.stat().st_mtime < ((datetime.now(CHINA_TZ) - timedelta(days=14)).timestamp())
-            and cache_file.is_file()
-        ):
-            cache_file.unlink()
-            logger.info(f"[Util.t2i] 删除过期缓存: {cache_file}")
-            r += 1
-    return i, r
+    return render_cache.prune()
+
+
+async def _render(
+    html: str,
+    width: int,
+    page_option: PageOption | None = None,
+    screenshot_option: ScreenshotOption | None = None,
+    *,
+    cache: bool = True,
+) -> bytes:
+    """渲染 HTML，cache 为 False 时不读写渲染缓存，用于带有时间或随机内容、不会重复出现的页面"""
+    if page_option and set(page_option) - {"viewport"}:
+        # 需要额外页面参数的渲染无法使用预热的页面
+        page_option = PageOption({**page_option, "viewport": {"width": width, "height": 10}})
+        render = functools.partial(
+            html_render.render, html, extra_page_option=page_option, extra_screenshot_option=screenshot_option
+        )
+    else:
+        render = functools.partial(page_pool.render, html, width=width, extra_screenshot_option=screenshot_option)
+    if not cache:
+        return await render()
+    key = render_cache.key(
+        RENDER_VERSION, style_hash, html, width, html_render.page_option, page_option, screenshot_option
+    )
+    return await render_cache.get_or_render(key, render)
+
+
+@functools.cache
+def _footer_font(size: int) -> ImageFont.FreeTypeFont:
+    """页脚文字使用的 HarmonyOS Sans 字体，与页面中通过 fill_font 加载的是同一个文件"""
+    path = font_path / "HarmonyOS_Sans_SC_Regular.ttf"
+    return ImageFont.truetype(str(path) if path.exists() else font_file, size)
+
+
+def _stack(body: bytes, footer: bytes) -> Image.Image:
+    body_image = Image.open(BytesIO(body)).convert("RGB")
+    footer_image = Image.open(BytesIO(footer)).convert("RGB")
+    image = Image.new("RGB", (body_image.width, body_image.height + footer_image.height), "#fafafa")
+    image.paste(body_image, (0, 0))
+    image.paste(footer_image, (0, body_image.height))
+    return image
+
+
+def _encode_jpeg(image: Image.Image) -> bytes:
+    output = BytesIO()
+    image.save(output, format="JPEG", quality=html_render.screenshot_option.get("quality") or 80)
+    return output.getvalue()
+
+
+def _attach_footer(body: bytes, footer: bytes) -> bytes:
+    """将页脚拼接到正文下方，两者均为 PNG 截图，拼接结果按 html_render 的截图参数编码一次 JPEG"""
+    return _encode_jpeg(_stack(body, footer))
+
+
+def _tag_footer(footer: bytes, time_box: dict) -> bytes:
+    output = BytesIO()
+    info = PngInfo()
+    info.add_text(FOOTER_TIME_INFO, json.dumps(time_box))
+    Image.open(BytesIO(footer)).save(output, format="PNG", pnginfo=info)
+    return output.getvalue()
+
+
+async def _render_footer(ad_html: str, width: int) -> bytes:
+    """渲染不含时间的页脚，时间所在元素的位置、字号和颜色记录在 PNG 的文本块中"""
+    footer, time_box = await page_pool.render_measured(
+        footer_html(ad_html, standalone=True),
+        FOOTER_TIME_SELECTOR,
+        width=width,
+        extra_screenshot_option=PNG_SCREENSHOT,
+    )
+    return await asyncio.to_thread(_tag_footer, footer, time_box)
+
+
+def _stack_bitmap(body: bytes, footer: bytes) -> bytes:
+    # BMP 不压缩，从内存缓存读取时几乎不需要解码
+    output = BytesIO()
+    _stack(body, footer).save(output, format="BMP")
+    return output.getvalue()
+
+
+async def _stitch(html: str, width: int, footer: bytes) -> bytes:
+    body = await _render(html, width, screenshot_option=PNG_SCREENSHOT)
+    return await asyncio.to_thread(_stack_bitmap, body, footer)
+
+
+def _draw_time(stitched: bytes, footer: bytes, time_text: str) -> bytes:
+    """按页脚中测得的位置在拼接好的图片上绘制时间，编码一次 JPEG"""
+    image = Image.open(BytesIO(stitched))
+    # 文本块位于图像数据之前，打开时即可读取，不需要解码页脚
+    footer_image = Image.open(BytesIO(footer))
+    time_box = json.loads(footer_image.info[FOOTER_TIME_INFO])
+    scale = html_render.page_option.get("device_scale_factor") or 1
+    top = image.height - footer_image.height
+    ImageDraw.Draw(image).text(
+        (time_box["x"] * scale, top + (time_box["y"] + time_box["height"] / 2) * scale),
+        time_text,
+        font=_footer_font(round(time_box["font_size"] * scale)),
+        fill=time_box["color"],
+        anchor="lm",
+    )
+    return _encode_jpeg(image)
+
+
+async def _render_with_footer(html: str, width: int) -> bytes:
+    """分别渲染正文和页脚后拼接
+
+    正文不含随机内容和时间，按内容缓存；页脚不含时间，按 (宽度, 广告) 缓存；
+    拼接结果只保存在内存缓存中，每次调用只绘制时间并编码一次 JPEG。
+    页面池未启动时无法测量时间的位置，页脚连同时间直接渲染
+    """
+    time_text = footer_time()
+    body_html = NO_BOTTOM_PADDING + html
+    ad_html = await footer_ad()
+    if not page_pool.running:
+        body, footer = await asyncio.gather(
+            _render(body_html, width, screenshot_option=PNG_SCREENSHOT),
+            page_pool.render(
+                footer_html(ad_html, time_text, standalone=True), width=width, extra_screenshot_option=PNG_SCREENSHOT
+            ),
+        )
+        return await asyncio.to_thread(_attach_footer, body, footer)
+    footer_key = render_cache.key(RENDER_VERSION, style_hash, "footer", width, ad_html)
+    footer = await render_cache.get_or_render(footer_key, functools.partial(_render_footer, ad_html, width))
+    stitched_key = render_cache.key(RENDER_VERSION, style_hash, "stitched", body_html, width, footer_key)
+    stitched = await render_cache.get_or_render(
+        stitched_key, functools.partial(_stitch, body_html, width, footer), persist=False
+    )
+    return await asyncio.to_thread(_draw_time, stitched, footer, time_text)
 
 
 async def html2img(
@@ -209,26 +353,16 @@ async def html2img(
     page_option: PageOption | None = None,
     screenshot_option: ScreenshotOption | None = None,
 ) -> bytes:
+    if screenshot_option is None and not (page_option and set(page_option) - {"viewport"}):
+        return await _render_with_footer(html, width)
+    # 页脚中的时间和广告使每次渲染的内容都不同，缓存不会被命中
     html += await add_footer()
-    if page_option is None:
-        page_option = PageOption(viewport={"width": width, "height": 10})
-    else:
-        page_option["viewport"] = {"width": width, "height": 10}
-    return await html_render.render(
-        html,
-        extra_page_option=page_option,
-        extra_screenshot_option=screenshot_option,
-    )
+    return await _render(html, width, page_option, screenshot_option, cache=False)
 
 
 async def text2img(text: str, width: int = 800) -> bytes:
     html = convert_text(text)
-    html += await add_footer()
-
-    return await html_render.render(
-        html,
-        extra_page_option=PageOption(viewport={"width": width, "height": 10}),
-    )
+    return await _render_with_footer(html, width)
 
 
 async def md2img(text: str, width: int = 800) -> bytes:
@@ -258,8 +392,22 @@ async def template2img(
         html_code = template.render(**render_option)
     else:
         html_code = Template(template).render(**render_option)
-    return await html_render.render(
-        html_code,
-        extra_page_option=extra_page_option,
-        extra_screenshot_option=extra_screenshot_option,
-    )
+    # 模板通常带有实时数据，渲染结果不写入缓存
+    viewport = (extra_page_option or {}).get("viewport")
+    if viewport is None or set(extra_page_option or {}) - {"viewport"}:
+        # 未指定视口时与 html_render.render 一样使用默认大小的页面，需要额外页面参数时也无法使用预热的页面
+        render = functools.partial(
+            html_render.render,
+            html_code,
+            extra_page_option=extra_page_option,
+            extra_screenshot_option=extra_screenshot_option,
+        )
+    else:
+        render = functools.partial(
+            page_pool.render,
+            html_code,
+            width=viewport["width"],
+            height=viewport.get("height", 10),
+            extra_screenshot_option=extra_screenshot_option,
+        )
+    return await render()